@@ -15,7 +15,7 @@
 #
 # -a : generate accessors for data in classes
 #
-# -n <block>: generate only files which match the specified name
+# -n <block>: generate only files which match the specified name, loading only the types it depends on
 #
 # --------------------------------------------------------------------------
 # ***** BEGIN LICENSE BLOCK *****
@@ -361,8 +361,8 @@ def compound_code_include_cpp_set(self, usedirs=False, gen_dir=None, obj_dir=Non
             file_name = '#include "%s%s.h"\n' % (obj_dir, mem.ctemplate)
             if file_name not in used_blocks:
                 used_blocks.append(file_name)
-        if mem.type in NAMES_COMPOUND:
-            subblock = TYPES_COMPOUND[mem.type]
+        if isinstance(mem.type_obj, Compound):
+            subblock = mem.type_obj
             used_blocks.extend(subblock.code_include_cpp_set(True, gen_dir, obj_dir))
         for terminal in mem.cond.get_terminals():
             if terminal in TYPES_BLOCK:
@@ -416,12 +416,6 @@ Block.gen_file_prefix = BLK_GEN_FILE_PREFIX
 Block.obj_file_prefix = BLK_OBJ_FILE_PREFIX
 Block.code_include_h = block_code_include_h
 
-#
-# Parse XML after patching classes
-#
-
-parse_xml(NATIVETYPES)
-
 #
 # global data
 #
@@ -570,8 +564,19 @@ for i in sys.argv:
         GENALLFILES = False
     prev = i
 
+#
+# Parse XML after patching classes, only the requested types and their dependencies with -n,
+# and stop before generating anything if a reference in it does not resolve
+#
+
+try:
+    parse_xml(NATIVETYPES, roots=None if GENALLFILES else GENBLOCKS, strict=True)
+except ValueError as e:
+    sys.exit(str(e))
+
 # Fix known manual update attributes. For now hard code here.
-TYPES_BLOCK["NiKeyframeData"].find_member("Num Rotation Keys").is_manual_update = True
+if "NiKeyframeData" in TYPES_BLOCK:
+    TYPES_BLOCK["NiKeyframeData"].find_member("Num Rotation Keys").is_manual_update = True
 # TYPES_BLOCK["NiTriStripsData"].find_member("Num Triangles").is_manual_update = True
 
 
@@ -859,14 +864,8 @@ class CFile(io.TextIOWrapper):
         # now comes the difficult part: processing all members recursively
         for y in block.members:
             # get block
-            if y.type in TYPES_BASIC:
-                subblock = TYPES_BASIC[y.type]
-            elif y.type in TYPES_COMPOUND:
-                subblock = TYPES_COMPOUND[y.type]
-            elif y.type in TYPES_ENUM:
-                subblock = TYPES_ENUM[y.type]
-            elif y.type in TYPES_FLAG:
-                subblock = TYPES_FLAG[y.type]
+            if y.type_obj is not None:
+                subblock = y.type_obj
 
             # check for links
             if action in [ACTION_FIXLINKS, ACTION_GETREFS, ACTION_GETPTRS]:
@@ -885,20 +884,11 @@ class CFile(io.TextIOWrapper):
             y_cond_prefix = ""
             y_arg_prefix = ""
             if y.arr1.lhs or y.arr2.lhs or y.cond.lhs or y.arg:
-                for z in block.members:
-                    if not y_arr1_lmember and y.arr1.lhs == z.name:
-                        y_arr1_lmember = z
-                    if not y_arr2_lmember and y.arr2.lhs == z.name:
-                        y_arr2_lmember = z
-                    if not y_cond_lmember:
-                        if y.cond.lhs == z.name:
-                            y_cond_lmember = z
-                        elif y.cond.op == '&&' and y.cond.lhs == z.name:
-                            y_cond_lmember = z
-                        elif y.cond.op == '||' and y.cond.lhs == z.name:
-                            y_cond_lmember = z
-                    if not y_arg and y.arg == z.name:
-                        y_arg = z
+                # the first of the block's own members of each name
+                y_arr1_lmember = block.find_member(y.arr1.lhs)
+                y_arr2_lmember = block.find_member(y.arr2.lhs)
+                y_cond_lmember = block.find_member(y.cond.lhs)
+                y_arg = block.find_member(y.arg)
                 if y_arr1_lmember:
                     y_arr1_prefix = prefix
                 if y_arr2_lmember:
@@ -909,22 +899,22 @@ class CFile(io.TextIOWrapper):
                     y_arg_prefix = prefix
             # resolve this prefix
             y_prefix = prefix
-            # resolve arguments
-            if y.arr1 and y.arr1.lhs == 'ARG':
-                y.arr1.lhs = arg_member.name
-                y.arr1.clhs = arg_member.cname
+            # resolve arguments, without modifying the shared expressions of the member
+            y_arr1 = y.arr1
+            y_arr2 = y.arr2
+            y_cond_expr = y.cond
+            if y_arr1.lhs == 'ARG':
+                y_arr1 = y_arr1.with_lhs(arg_member.name)
                 y_arr1_prefix = arg_prefix
-            if y.arr2 and y.arr2.lhs == 'ARG':
-                y.arr2.lhs = arg_member.name
-                y.arr2.clhs = arg_member.cname
+            if y_arr2.lhs == 'ARG':
+                y_arr2 = y_arr2.with_lhs(arg_member.name)
                 y_arr2_prefix = arg_prefix
-            if y.cond and y.cond.lhs == 'ARG':
-                y.cond.lhs = arg_member.name
-                y.cond.clhs = arg_member.cname
+            if y_cond_expr.lhs == 'ARG':
+                y_cond_expr = y_cond_expr.with_lhs(arg_member.name)
                 y_cond_prefix = arg_prefix
             # conditioning
-            y_cond = y.cond.code(y_cond_prefix)
-            y_vercond = y.vercond.code('info.')
+            y_cond = y_cond_expr.simplify(condition=True).code(y_cond_prefix)
+            y_vercond = y.vercond.simplify(condition=True).code('info.')
             if action in [ACTION_READ, ACTION_WRITE, ACTION_FIXLINKS]:
                 if lastver1 != y.ver1 or lastver2 != y.ver2 or lastuserver != y.userver or lastuserver2 != y.userver2 or lastvercond != y_vercond:
                     # we must switch to a new version block
@@ -979,17 +969,17 @@ class CFile(io.TextIOWrapper):
                         self.code("if ( %s ) {" % y_cond)
             # loop over arrays
             # and resolve variable name
-            if not y.arr1.lhs:
+            if not y_arr1.lhs:
                 z = "%s%s" % (y_prefix, y.cname)
             else:
                 if action == ACTION_OUT:
                     self.code("array_output_count = 0;")
-                if not y.arr1.lhs.isdigit():
+                if not y_arr1.lhs.isdigit():
                     if action == ACTION_READ:
                         # default to local variable, check if variable is in current scope if not then try to use
                         #   definition from resized child
-                        memcode = "%s%s.resize(%s);" % (y_prefix, y.cname, y.arr1.code(y_arr1_prefix))
-                        mem = block.find_member(y.arr1.lhs, True)  # find member in self or parents
+                        memcode = "%s%s.resize(%s);" % (y_prefix, y.cname, y_arr1.code(y_arr1_prefix))
+                        mem = block.find_member(y_arr1.lhs, True)  # find member in self or parents
                         self.code(memcode)
                     self.code(
                         "for (unsigned int i%i = 0; i%i < %s%s.size(); i%i++) {" \
@@ -997,35 +987,35 @@ class CFile(io.TextIOWrapper):
                 else:
                     self.code(
                         "for (unsigned int i%i = 0; i%i < %s; i%i++) {" \
-                        % (self.indent, self.indent, y.arr1.code(y_arr1_prefix), self.indent))
+                        % (self.indent, self.indent, y_arr1.code(y_arr1_prefix), self.indent))
                 if action == ACTION_OUT:
                     self.code('if ( !verbose && ( array_output_count > MAXARRAYDUMP ) ) {')
                     self.code('%s << "<Data Truncated. Use verbose mode to see complete listing.>" << endl;' % stream)
                     self.code('break;')
                     self.code('};')
-                if not y.arr2.lhs:
+                if not y_arr2.lhs:
                     z = "%s%s[i%i]" % (y_prefix, y.cname, self.indent - 1)
                 else:
                     if not y.arr2_dynamic:
-                        if not y.arr2.lhs.isdigit():
+                        if not y_arr2.lhs.isdigit():
                             if action == ACTION_READ:
                                 self.code("%s%s[i%i].resize(%s);" % (
-                                y_prefix, y.cname, self.indent - 1, y.arr2.code(y_arr2_prefix)))
+                                y_prefix, y.cname, self.indent - 1, y_arr2.code(y_arr2_prefix)))
                             self.code( \
                                 "for (unsigned int i%i = 0; i%i < %s%s[i%i].size(); i%i++) {" \
                                 % (self.indent, self.indent, y_prefix, y.cname, self.indent - 1, self.indent))
                         else:
                             self.code( \
                                 "for (unsigned int i%i = 0; i%i < %s; i%i++) {" \
-                                % (self.indent, self.indent, y.arr2.code(y_arr2_prefix), self.indent))
+                                % (self.indent, self.indent, y_arr2.code(y_arr2_prefix), self.indent))
                     else:
                         if action == ACTION_READ:
                             self.code("%s%s[i%i].resize(%s[i%i]);" \
                                       % (
-                                      y_prefix, y.cname, self.indent - 1, y.arr2.code(y_arr2_prefix), self.indent - 1))
+                                      y_prefix, y.cname, self.indent - 1, y_arr2.code(y_arr2_prefix), self.indent - 1))
                         self.code(
                             "for (unsigned int i%i = 0; i%i < %s[i%i]; i%i++) {" \
-                            % (self.indent, self.indent, y.arr2.code(y_arr2_prefix), self.indent - 1, self.indent))
+                            % (self.indent, self.indent, y_arr2.code(y_arr2_prefix), self.indent - 1, self.indent))
                     z = "%s%s[i%i][i%i]" % (y_prefix, y.cname, self.indent - 2, self.indent - 1)
 
             if y.type in TYPES_NATIVE:
@@ -1035,7 +1025,7 @@ class CFile(io.TextIOWrapper):
                         # not a ref
                         if action in [ACTION_READ, ACTION_WRITE] and y.is_abstract is False:
                             # hack required for vector<bool>
-                            if y.type == "bool" and y.arr1.lhs:
+                            if y.type == "bool" and y_arr1.lhs:
                                 self.code("{")
                                 if action == ACTION_READ:
                                     self.code("bool tmp;")
@@ -1073,7 +1063,7 @@ class CFile(io.TextIOWrapper):
                                 self.code('if ( %s != NULL )\n\tptrs.push_back((NiObject *)(%s));' % (z, z))
                 # the following actions don't distinguish between refs and non-refs
                 elif action == ACTION_OUT:
-                    if not y.arr1.lhs:
+                    if not y_arr1.lhs:
                         self.code('%s << "%*s%s:  " << %s << endl;' % (stream, 2 * self.indent, "", y.name, z))
                     else:
                         self.code('if ( !verbose && ( array_output_count > MAXARRAYDUMP ) ) {')
@@ -1083,18 +1073,18 @@ class CFile(io.TextIOWrapper):
                         stream, 2 * self.indent, "", y.name, self.indent - 1, z))
                         self.code('array_output_count++;')
             else:
-                subblock = TYPES_COMPOUND[y.type]
-                if not y.arr1.lhs:
+                subblock = y.type_obj
+                if not y_arr1.lhs:
                     self.stream(subblock, action, "%s%s_" % (localprefix, y.cname), "%s." % z, y_arg_prefix, y_arg)
-                elif not y.arr2.lhs:
+                elif not y_arr2.lhs:
                     self.stream(subblock, action, "%s%s_" % (localprefix, y.cname), "%s." % z, y_arg_prefix, y_arg)
                 else:
                     self.stream(subblock, action, "%s%s_" % (localprefix, y.cname), "%s." % z, y_arg_prefix, y_arg)
 
             # close array loops
-            if y.arr1.lhs:
+            if y_arr1.lhs:
                 self.code("};")
-                if y.arr2.lhs:
+                if y_arr2.lhs:
                     self.code("};")
 
             lastver1 = y.ver1
@@ -0,0 +1,672 @@
+#!/usr/bin/python3
+"""
+nifbench.py
+
+Measures the performance of the nif.xml loader and of evaluating its expressions.
+
+To list command line options run:
+    nifbench.py -h
+
+This file is part of nifxml <https://www.github.com/niftools/nifxml>
+Copyright (c) 2017-2020 NifTools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import gc
+import os
+import sys
+import ast
+import json
+import random
+import time
+import types
+import timeit
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from xml.etree.ElementTree import ElementTree, parse
+
+import nifxml
+import nifbin
+
+# Attributes which refer to the name of another type
+TYPE_ATTRIBUTES = ('type', 'template', 'inherit', 'storage')
+
+# Loaders to compare, each run in a fresh interpreter since parse_xml fills module globals
+LOADERS = {
+    'minidom': "DOM document only, as kept alive by the original loader",
+    'tree': "parse_xml(streaming=False, cache=False)",
+    'stream': "parse_xml(cache=False)",
+    'cache': "parse_xml() from a warm cache",
+    'edit': "parse_xml(previous=...) after editing the last <niobject>",
+    'parallel': "parse_xml(cache=False, workers=..., min_parallel=0) with a process per CPU",
+    'binary': "nifbin.open_schema() of an exported copy, reading every member",
+}
+
+
+def scale_xml(path, scale, out):
+    """
+    Writes a copy of the XML with every type declared `scale` times.
+    Each copy renames its types and the references to them, so all copies resolve.
+    """
+    root = parse(path).getroot()
+    kinds = [tag for tag in sorted(nifxml.TAG_RANKS, key=nifxml.TAG_RANKS.get) if tag != 'version']
+    elements = list(root)
+    names = {e.get('name') for e in elements if e.tag in kinds}
+    root[:] = [e for e in elements if e.tag == 'version']
+    for tag in kinds:
+        for copy in range(scale):
+            for element in elements:
+                if element.tag != tag:
+                    continue
+                if copy:
+                    element = parse_copy(element, names, ' %d' % copy)
+                root.append(element)
+    ElementTree(root).write(out, encoding='utf-8', xml_declaration=True)
+
+
+def parse_copy(element, names, suffix):
+    """Deep copies an element, suffixing every type name it declares or references."""
+    clone = element.makeelement(element.tag, dict(element.attrib))
+    clone.text = element.text
+    clone.tail = element.tail
+    for attr in ('name',) + TYPE_ATTRIBUTES:
+        if clone.get(attr) in names and (attr != 'name' or element.tag != 'field'):
+            clone.set(attr, clone.get(attr) + suffix)
+    for child in element:
+        clone.append(parse_copy(child, names, suffix))
+    return clone
+
+
+def edit_xml(path, out):
+    """Writes a copy of the XML with the description of the last <niobject> changed."""
+    tree = parse(path)
+    block = [element for element in tree.getroot() if element.tag == 'niobject'][-1]
+    block.text = (block.text or '') + ' Edited.'
+    tree.write(out, encoding='utf-8', xml_declaration=True)
+
+
+def measure(loader, path, trace):
+    """Runs one loader in this process and returns its wall time and peak traced memory."""
+    if loader == 'edit':
+        previous = nifxml.parse_xml(path=path, cache=False, incremental=True)
+        edited = tempfile.NamedTemporaryFile(suffix='.xml', delete=False).name
+        edit_xml(path, edited)
+    if loader == 'binary':
+        exported = tempfile.NamedTemporaryFile(suffix='.nifs', delete=False).name
+        nifbin.export_schema(nifxml.parse_xml(path=path, activate=False), exported)
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    if loader == 'minidom':
+        from xml.dom.minidom import parse as dom_parse
+        xml = dom_parse(path)
+        for tag in nifxml.TAG_RANKS:
+            xml.getElementsByTagName(tag)
+    elif loader == 'edit':
+        nifxml.parse_xml(path=edited, cache=False, previous=previous)
+    elif loader == 'parallel':
+        nifxml.parse_xml(path=path, cache=False, workers=os.cpu_count() or 1, min_parallel=0)
+    elif loader == 'binary':
+        with nifbin.open_schema(exported) as schema:
+            for kind in ('compound', 'niobject'):
+                for view in schema.types(kind):
+                    view.members()
+    else:
+        nifxml.parse_xml(path=path, streaming=(loader != 'tree'), cache=(loader == 'cache'))
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if trace else 0
+    if loader == 'edit':
+        os.remove(edited)
+    if loader == 'binary':
+        os.remove(exported)
+    return {'time': elapsed, 'peak': peak}
+
+
+def unslotted_nifxml():
+    """
+    Returns nifxml built again from its source without any __slots__, as Member, Option and Expression were
+    before they had them, for retained() to measure both layouts. The copy replaces nifxml in sys.modules.
+    """
+    with open(nifxml.__file__, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), nifxml.__file__)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef):
+            node.body = [stmt for stmt in node.body
+                         if not (isinstance(stmt, ast.Assign)
+                                 and any(isinstance(target, ast.Name) and target.id == '__slots__'
+                                         for target in stmt.targets))] or [ast.Pass()]
+    module = types.ModuleType(nifxml.__name__, nifxml.__doc__)
+    module.__file__ = nifxml.__file__
+    sys.modules[nifxml.__name__] = module
+    exec(compile(ast.fix_missing_locations(tree), nifxml.__file__, 'exec'), module.__dict__)
+    return module
+
+
+def retained(path, top=8, slotted=True):
+    """
+    Loads the XML in this process and returns the traced memory still held by the tables.
+    @param slotted: Load with nifxml as it is, else with its classes without __slots__, see unslotted_nifxml().
+    """
+    module = nifxml if slotted else unslotted_nifxml()
+    tracemalloc.start()
+    schema = module.parse_xml(path=path, cache=False)
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(True, module.__file__)])
+    counts = {}
+    for table in schema.tables()[:7]:
+        for obj in table.values():
+            for mem in getattr(obj, 'members', ()):
+                counts['Member'] = counts.get('Member', 0) + 1
+            for opt in getattr(obj, 'options', ()):
+                counts['Option'] = counts.get('Option', 0) + 1
+    counts['Expression'] = module.Expression.cache_info().currsize
+    return {
+        'retained': tracemalloc.get_traced_memory()[0],
+        'counts': counts,
+        'sites': [(str(stat.traceback[0]), stat.size, stat.count)
+                  for stat in snapshot.statistics('lineno')[:top]],
+    }
+
+
+def report_memory(path):
+    """
+    Prints the memory retained by the parsed tables, with and without __slots__ on the classes,
+    and the lines which allocated most of it.
+    """
+    results = {}
+    for layout, options in (('unslotted', ['--unslotted']), ('slotted', [])):
+        cmd = [sys.executable, os.path.abspath(__file__), '--measure', 'memory', '--path', path] + options
+        out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        results[layout] = json.loads(out)
+    result, before = results['slotted'], results['unslotted']['retained']
+    print('Memory (%s, %.1f MB retained, %.1f MB without __slots__, %.0f%% less)'
+          % (path, result['retained'] / 2**20, before / 2**20, 100 * (1 - result['retained'] / before)))
+    print('  ' + ', '.join('%d %s' % (n, name) for name, n in sorted(result['counts'].items())))
+    for site, size, count in result['sites']:
+        print('  %8.1f KB %8d blocks  %s' % (size / 2**10, count, os.path.basename(site)))
+
+
+def run(loader, path, trace):
+    """Runs one loader in a fresh interpreter."""
+    cmd = [sys.executable, os.path.abspath(__file__), '--measure', loader, '--path', path]
+    if trace:
+        cmd.append('--trace')
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(out)
+
+
+def report(title, path, repeat):
+    """Prints wall time (best of `repeat`) and peak memory for each loader."""
+    print('%s (%s, %.1f MB)' % (title, path, os.path.getsize(path) / 2**20))
+    nifxml.reset_xml()
+    nifxml.parse_xml(path=path)  # warm the cache
+    for loader, desc in LOADERS.items():
+        best = min(run(loader, path, False)['time'] for _ in range(repeat))
+        peak = run(loader, path, True)['peak']
+        print('  %-8s %8.1f ms %8.1f MB peak  %s' % (loader, best * 1000, peak / 2**20, desc))
+
+
+def report_parallel(path, scale, repeat):
+    """
+    Prints wall time (best of `repeat`) of the tree and parallel loaders on the XML and on copies of it
+    up to `scale` times larger, and from how many compounds and blocks the parallel one is faster,
+    for setting nifxml.PARALLEL_MIN_TYPES.
+    """
+    workers = os.cpu_count() or 1
+    print('Parallel loader (%s, %d workers, used from %d compounds and blocks)'
+          % (path, workers, nifxml.PARALLEL_MIN_TYPES))
+    if workers < 2:
+        print('  With one CPU the parallel loader builds in this process, like the tree one.')
+    faster = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for copies in sorted({2 ** i for i in range(scale.bit_length())} | {scale}):
+            scaled = path
+            if copies > 1:
+                scaled = os.path.join(tmp, 'nif_x%d.xml' % copies)
+                scale_xml(path, copies, scaled)
+            types = sum(1 for element in parse(scaled).getroot() if element.tag in ('compound', 'niobject'))
+            tree = min(run('tree', scaled, False)['time'] for _ in range(repeat))
+            parallel = min(run('parallel', scaled, False)['time'] for _ in range(repeat))
+            print('  %8d types %8.1f ms tree %8.1f ms parallel  %.2fx' % (types, tree * 1000, parallel * 1000,
+                                                                        tree / parallel))
+            if parallel < tree and faster is None:
+                faster = types
+            elif parallel >= tree:
+                faster = None
+    if faster is None:
+        print('  The parallel loader is not faster at any size measured.')
+    else:
+        print('  The parallel loader is faster from %d types.' % faster)
+
+
+class Record:
+    """A record answering every field with the same value."""
+    def __init__(self, value):
+        self.value = value
+
+    def __getattr__(self, name):
+        return self.value
+
+
+def member_expressions():
+    """Returns every distinct non-empty size, condition and version condition expression."""
+    found = {}
+    for types in (nifxml.TYPES_COMPOUND, nifxml.TYPES_BLOCK):
+        for compound in types.values():
+            for mem in compound.members:
+                for expr in (mem.arr1, mem.arr2, mem.cond, mem.vercond):
+                    if expr.lhs:
+                        found[id(expr)] = expr
+    return list(found.values())
+
+
+def outcome(func, data):
+    """Returns the result of func(data), or the type of exception it raised."""
+    try:
+        return func(data)
+    except (ArithmeticError, TypeError) as ex:
+        return type(ex)
+
+
+def check_compiled(exprs):
+    """
+    Raises a RuntimeError if compile() of an expression gives another result than eval(),
+    for records answering every field with 0, 1 or 7.
+
+    >>> check_compiled([nifxml.Expression(text) for text in
+    ...                 ('Num Vertices', '!Has Normals', '(Flags & 0x04) != 0', 'Num Vertices / (Flags - 1)',
+    ...                  'Version >= 0x0A000100 && (User Version 2 > 7 || Has Normals)', '1 + 2 * 3 - Count',
+    ...                  '!(Count == 7) || Count <= 1', 'Count | 8', 'Count > 0 && Count < 7')])
+    """
+    for expr in exprs:
+        func = expr.compile()
+        for data in (Record(value) for value in (0, 1, 7)):
+            expected, result = outcome(expr.eval, data), outcome(func, data)
+            if result != expected:
+                raise RuntimeError("compile() of '%s' gives %r for %d, eval() %r"
+                                   % (expr, result, data.value, expected))
+
+
+def report_expressions(path, repeat):
+    """Checks compile() against eval() on every member expression, then times both."""
+    nifxml.parse_xml(path=path)
+    exprs = member_expressions()
+    start = time.perf_counter()
+    compiled = [(expr, expr.compile()) for expr in exprs]
+    compile_time = time.perf_counter() - start
+    check_compiled(exprs)
+
+    data = Record(1)
+    def run_eval():
+        for expr in exprs:
+            expr.eval(data)
+    def run_compiled():
+        for _, func in compiled:
+            func(data)
+    calls = len(exprs) * 100
+    print('Expressions (%s, %d distinct)' % (path, len(exprs)))
+    print('  compile  %8.1f ms once' % (compile_time * 1000))
+    for name, func in (('eval', run_eval), ('compiled', run_compiled)):
+        best = min(timeit.repeat(func, number=100, repeat=repeat))
+        print('  %-8s %8.3f us per call' % (name, best / calls * 1e6))
+
+
+def reference_class_name(name_in):
+    """class_name of a type which is not native, as formatted by the original loop"""
+    return name_in.replace(' ', '_').replace(":", "_")
+
+
+def reference_define_name(name_in):
+    """define_name as formatted by the original loop"""
+    name_out = ''
+    for i, char in enumerate(name_in):
+        if char.isupper():
+            if i > 0:
+                name_out += '_'
+                name_out += char
+            else:
+                name_out += char
+        elif char.islower() or char.isdigit():
+            name_out += char.upper()
+        else:
+            name_out += '_'
+    return name_out
+
+
+def reference_member_name(name_in):
+    """member_name as formatted by the original loop"""
+    if name_in is None or name_in == 'ARG':
+        return name_in
+    name_out = ''
+    lower = True
+    for char in name_in:
+        if char == ' ':
+            lower = False
+        elif char.isalnum():
+            if lower:
+                name_out += char.lower()
+            else:
+                name_out += char.upper()
+                lower = True
+        elif char == '\\':
+            name_out += '.'
+        else:
+            name_out += '_'
+            lower = True
+    return name_out
+
+
+def xml_names(path):
+    """Returns every distinct name, type name and expression terminal in the XML."""
+    names = set()
+    for element in parse(path).getroot().iter():
+        for attr in ('name', 'arg', 'arr1', 'arr2', 'cond', 'vercond') + TYPE_ATTRIBUTES:
+            value = element.get(attr)
+            if not value:
+                continue
+            names.add(value)
+            if attr in ('arg', 'arr1', 'arr2', 'cond', 'vercond'):
+                names.update(nifxml.Expr(value).get_terminals())
+    return sorted(names)
+
+
+def name_formatters(names):
+    """Returns each name formatter with the original loop it replaces and the names to format with both."""
+    cnames = [nifxml.class_name(name, {}) for name in names]
+    return (('class_name', lambda name: nifxml.class_name(name, {}), reference_class_name, names),
+            ('member_name', nifxml.member_name, reference_member_name, names),
+            ('define_name', nifxml.define_name, reference_define_name, names + cnames))
+
+
+def check_names(names):
+    """
+    Raises a RuntimeError if a name formatter formats a name otherwise than the original loop.
+
+    >>> check_names(['Num Vertices', 'Has UV Sets', 'ARG\\\\Num Keys', 'Unknown 2-Bytes', 'BS Bound:Box',
+    ...              'NiTriShape', 'bhkRigidBody_T', 'BSLODTriShape', ' Leading  Space ', 'Sub \\\\ Field (Old)',
+    ...              'Ünïcode Näme', 'x_y', '0x0A000100', 'Vector3', 'ARG', 'TEMPLATE', 'a.b', ''])
+    """
+    for title, func, reference, inputs in name_formatters(names):
+        for name in inputs:
+            if func(name) != reference(name):
+                raise RuntimeError("%s('%s') is '%s', originally '%s'" % (title, name, func(name), reference(name)))
+
+
+def report_names(path, repeat):
+    """Checks the name formatters against the original loops on every name in the XML, then times both."""
+    names = xml_names(path)
+    check_names(names)
+    print('Names (%s, %d distinct)' % (path, len(names)))
+    for title, func, reference, inputs in name_formatters(names):
+        def run_func():
+            for name in inputs:
+                func(name)
+        def run_reference():
+            for name in inputs:
+                reference(name)
+        best = min(timeit.repeat(run_func, number=10, repeat=repeat))
+        best_reference = min(timeit.repeat(run_reference, number=10, repeat=repeat))
+        calls = len(inputs) * 10
+        print('  %-12s %8.3f us per call, %8.3f us originally' % (title, best / calls * 1e6,
+                                                                   best_reference / calls * 1e6))
+
+
+def reference_scan_brackets(expr_str):
+    """The original bracket scan of Expression, see reference_partition()."""
+    startpos = -1
+    endpos = -1
+    scandepth = 0
+    for scanpos, scanchar in enumerate(expr_str):
+        if scanchar == "(":
+            if startpos == -1:
+                startpos = scanpos
+            scandepth += 1
+        elif scanchar == ")":
+            scandepth -= 1
+            if scandepth == 0:
+                endpos = scanpos
+                break
+    else:
+        if startpos != -1 or endpos != -1:
+            raise ValueError("expression syntax error (non-matching brackets?)")
+    return startpos, endpos
+
+
+def reference_partition(expr_str):
+    """The original split of an expression at its first operator, ignoring precedence."""
+    operators = ['==', '!=', '>=', '<=', '&&', '||', '&', '|', '-', '+', '>', '<', '/', '*']
+    if expr_str.strip().startswith('!'):
+        return expr_str.lstrip(' !'), '!', None
+    lenstr = len(expr_str)
+    left_startpos, left_endpos = reference_scan_brackets(expr_str)
+    if left_startpos >= 0:
+        left_str = expr_str[left_startpos+1:left_endpos].strip()
+        op_startpos = left_endpos+1
+        while op_startpos < lenstr and expr_str[op_startpos] == " ":
+            op_startpos += 1
+        if op_startpos < lenstr:
+            for op_endpos in range(op_startpos+1, op_startpos-1, -1):
+                op_str = expr_str[op_startpos:op_endpos+1]
+                if op_str in operators:
+                    break
+            else:
+                raise ValueError("expression syntax error: expected operator at '%s'"%expr_str[op_startpos:])
+        else:
+            return reference_partition(left_str)
+    else:
+        for op_startpos, ch in enumerate(expr_str):
+            if ch == ' ':
+                continue
+            if ch == '(' or ch == ')':
+                raise ValueError("expression syntax error: expected operator before '%s'"%expr_str[op_startpos:])
+            for op_endpos in range(op_startpos+1, op_startpos-1, -1):
+                op_str = expr_str[op_startpos:op_endpos+1]
+                if op_str in operators:
+                    break
+            else:
+                continue
+            break
+        else:
+            return expr_str.strip(), '', ''
+        left_str = expr_str[:op_startpos].strip()
+    return left_str, op_str, expr_str[op_endpos+1:].strip()
+
+
+def reference_parse(expr_str):
+    """The tree the original parser built for an expression, in the form of expression_tree()."""
+    left, op, right = reference_partition(expr_str)
+    left = reference_operand(left)
+    right = reference_operand(right) if right else ''
+    return (left, op, right) if op else left
+
+
+def reference_operand(expr_str):
+    """The original parse of an operand, a sub-expression if it has brackets or an operator anywhere."""
+    if '(' in expr_str or ')' in expr_str or any(op in expr_str for op in nifxml.Expression.binding_power):
+        return reference_parse(expr_str)
+    return nifxml.Expression._literal(expr_str)
+
+
+def expression_tree(expr):
+    """Returns an expression as nested (lhs, op, rhs) tuples, with a bracketed terminal as just the terminal."""
+    if not isinstance(expr, nifxml.Expression):
+        return expr
+    if not expr.op:
+        return expression_tree(expr.lhs)
+    return (expression_tree(expr.lhs), expr.op, expression_tree(expr.rhs))
+
+
+def format_tree(tree, minimal=False, min_power=-1):
+    """Formats a tree of expression_tree(), with every operand in brackets, or only where precedence needs them.
+    The original parser only read a bracket as the start of the left hand side if it came first."""
+    if not isinstance(tree, tuple):
+        return tree if minimal else '(%s)' % tree
+    left, op, right = tree
+    if op == '!':
+        return '!' + format_tree(left, minimal, 99) if minimal else '(!%s)' % format_tree(left)
+    power = nifxml.Expression.binding_power[op]
+    grouped = op in nifxml.Expression.right_associative
+    text = '%s %s %s' % (format_tree(left, minimal, power + grouped), op,
+                         format_tree(right, minimal, power + (not grouped)))
+    if minimal and power >= min_power:
+        return text
+    return '(' + text + ')'
+
+
+def random_tree(rand, depth):
+    """Returns a random tree of expression_tree() form."""
+    terminals = ['Num Vertices', 'Has Normals', 'ARG', 'User Version 2', '0', '4', '0x0A000100']
+    if depth == 0 or rand.random() < 0.2:
+        return rand.choice(terminals)
+    if rand.random() < 0.1:
+        return (random_tree(rand, depth - 1), '!', '')
+    return (random_tree(rand, depth - 1), rand.choice(list(nifxml.Expression.binding_power)),
+            random_tree(rand, depth - 1))
+
+
+def xml_expressions(path):
+    """Returns every distinct expression in the XML."""
+    exprs = set()
+    for element in parse(path).getroot().iter():
+        for attr in ('arg', 'arr1', 'arr2', 'cond', 'vercond'):
+            if element.get(attr):
+                exprs.add(element.get(attr))
+    return sorted(exprs)
+
+
+def check_parser(exprs, fuzz):
+    """
+    Raises a RuntimeError if the expression parser builds another tree than the original for an expression,
+    unless the original agrees once every operand is bracketed. Also if either parser does not read back
+    a number of random trees, formatted with every operand bracketed, or for the parser only where precedence
+    needs brackets. Returns the expressions the original parser grouped differently.
+
+    >>> check_parser(['Num Vertices > 0 && Has Normals', '(Flags & 1) != 0', 'ARG == 2 || ARG == 3',
+    ...               '!Has Normals', 'Num Strips - 1 - ARG', 'Data Size / 4'], fuzz=2000)
+    ['Num Vertices > 0 && Has Normals', 'ARG == 2 || ARG == 3', 'Num Strips - 1 - ARG']
+    """
+    regrouped = []
+    for text in exprs:
+        tree = expression_tree(nifxml.Expression(text))
+        if tree != reference_parse(text):
+            # the original parser ignored precedence, but agrees once every operand is bracketed
+            if reference_parse(format_tree(tree)) != tree:
+                raise RuntimeError("'%s' parses to %r, originally to %r even with every operand bracketed"
+                                   % (text, tree, reference_parse(format_tree(tree))))
+            regrouped.append(text)
+    rand = random.Random(0)
+    for _ in range(fuzz):
+        tree = random_tree(rand, 4)
+        for text in (format_tree(tree), format_tree(tree, True)):
+            if expression_tree(nifxml.Expression(text)) != tree:
+                raise RuntimeError("'%s' parses to %r, not %r"
+                                   % (text, expression_tree(nifxml.Expression(text)), tree))
+        if reference_parse(format_tree(tree)) != tree:
+            raise RuntimeError("'%s' parsed to %r originally, not %r"
+                               % (format_tree(tree), reference_parse(format_tree(tree)), tree))
+    return regrouped
+
+
+def report_parser(path, repeat, fuzz=20000):
+    """Checks the expression parser against the original on every expression in the XML and on random trees,
+    then times both."""
+    exprs = xml_expressions(path)
+    regrouped = check_parser(exprs, fuzz)
+
+    def run_parse():
+        for text in exprs:
+            nifxml.Expression(text)
+    def run_reference():
+        for text in exprs:
+            reference_parse(text)
+    best = min(timeit.repeat(run_parse, number=10, repeat=repeat))
+    best_reference = min(timeit.repeat(run_reference, number=10, repeat=repeat))
+    calls = len(exprs) * 10
+    print('Expression parser (%s, %d distinct, %d random)' % (path, len(exprs), fuzz))
+    for text in regrouped:
+        print('  parsed differently originally: %s' % text)
+    print('  parse    %8.3f us per expression, %8.3f us originally' % (best / calls * 1e6,
+                                                                        best_reference / calls * 1e6))
+
+
+def report_phases(path):
+    """Prints where the time and memory of each loader go, see nifxml.Profile."""
+    for loader, kwargs in (('stream', {}), ('tree', {'streaming': False})):
+        profile = nifxml.Profile()
+        nifxml.parse_xml(path=path, cache=False, profile=profile, **kwargs)
+        print('Phases of the %s loader (%s)' % (profile.loader, path))
+        phases = sorted(profile.phases.items(), key=lambda item: -item[1]['seconds'])
+        for name, stats in phases:
+            print('  %-16s %8.1f ms %6d calls %8d blocks %6d objects' % (
+                name, stats['seconds'] * 1000, stats['calls'], stats['blocks'], stats['objects']))
+
+
+def main():
+    """Benchmarks the loaders on nif.xml and on a scaled up synthetic copy of it"""
+    parser = argparse.ArgumentParser(description="NIF Format XML Loader Benchmark")
+    parser.add_argument('benchmark', nargs='?', default='load',
+                        choices=['load', 'expr', 'memory', 'names', 'parse', 'parallel', 'phases'],
+                        help="Time the loaders, evaluation of the compiled expressions, the name formatters "
+                             "or the expression parser, measure the memory held by the parsed tables "
+                             "with and without __slots__, time the parallel loader against the tree one "
+                             "on larger copies of the XML, or profile the phases of loading.")
+    parser.add_argument('-p', '--path', help="The XML file to load, defaults to nif.xml.")
+    parser.add_argument('-s', '--scale', type=int, default=10,
+                        help="How many times each type is declared in the synthetic XML, "
+                             "the largest of the copies for 'parallel'.")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Timed runs per loader.")
+    parser.add_argument('--measure', choices=list(LOADERS) + ['memory'], help=argparse.SUPPRESS)
+    parser.add_argument('--trace', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--unslotted', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    path = nifxml.find_xml(args.path)
+    if args.measure == 'memory':
+        print(json.dumps(retained(path, slotted=not args.unslotted)))
+        return
+    if args.measure:
+        print(json.dumps(measure(args.measure, path, args.trace)))
+        return
+    if args.benchmark == 'expr':
+        report_expressions(path, args.repeat)
+        return
+    if args.benchmark == 'memory':
+        report_memory(path)
+        return
+    if args.benchmark == 'names':
+        report_names(path, args.repeat)
+        return
+    if args.benchmark == 'parse':
+        report_parser(path, args.repeat)
+        return
+    if args.benchmark == 'parallel':
+        report_parallel(path, args.scale, args.repeat)
+        return
+    if args.benchmark == 'phases':
+        report_phases(path)
+        return
+
+    report('Loader', path, args.repeat)
+    if args.scale > 1:
+        with tempfile.TemporaryDirectory() as tmp:
+            scaled = os.path.join(tmp, 'nif_x%d.xml' % args.scale)
+            scale_xml(path, args.scale, scaled)
+            report('Loader x%d' % args.scale, scaled, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
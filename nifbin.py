@@ -0,0 +1,589 @@
+#!/usr/bin/python3
+"""
+nifbin.py
+
+Writes a parsed schema to a compact binary file, and opens such a file without parsing or unpickling it.
+
+The file holds the resolved schema: the versions, the types with their members and options,
+and the expressions of the members compiled to postfix code. Opening it maps the file into memory
+and only reads the header; types, members and expressions are read when first asked for.
+The reader does not import nifxml, so a short-lived process opens a schema in well under a millisecond.
+
+To list command line options run:
+    nifbin.py -h
+
+This file is part of nifxml <https://www.github.com/niftools/nifxml>
+Copyright (c) 2017-2020 NifTools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+
+# Start of every file, and the layout it was written with
+MAGIC = b'NIFS'
+FORMAT_VERSION = 2
+
+# The tags of the types, in the order they are stored; a type records the index of its tag
+KINDS = ('basic', 'enum', 'bitflags', 'compound', 'niobject')
+
+# Stands for None in string and type references
+NONE = 0xFFFFFFFF
+
+# The sections of the file, each stored as the offset of its first record and the number of records
+SECTIONS = ('strings', 'versions', 'types', 'members', 'options', 'expressions', 'code')
+
+# Header: magic, format version, kind of XML (string), then an offset and count per section
+HEADER = struct.Struct('<4sII' + 'II' * len(SECTIONS))
+# Offsets of the strings into the string data, which follows them; one more than there are strings
+STRING_OFFSET = struct.Struct('<I')
+# Version: number as in the XML (string), packed number
+VERSION = struct.Struct('<II')
+# Type: kind, flags, then strings name, cname, nativetype, description, count, storage, prefix,
+#  then the parent block (type), first member, member count, first option, option count
+TYPE = struct.Struct('<BBxx7IIIIII')
+# Member: strings name, suffix, type, arg, template, function, default, ver1 and ver2 as in the XML,
+#  description, cname, ctype, carg, ctemplate, then the type and template (types), packed ver1 and ver2,
+#  userver and userver2 (-1 for None), expressions arr1, arr2, cond, vercond, next duplicate (member), flags
+MEMBER = struct.Struct('<14III' 'qqqq' 'IIII' 'IH2x')
+# Option: strings name, description, cname, value, then the bit of a bitflags option, -1 for an enum option
+OPTION = struct.Struct('<IIIIi')
+# Expression: its text (string), first instruction of its code and number of instructions
+EXPRESSION = struct.Struct('<III')
+# Instruction: opcode, operand
+INSTRUCTION = struct.Struct('<iq')
+
+# Bits of the type flags
+TYPE_FLAGS = ('template', 'is_link', 'is_crossref', 'has_links', 'has_crossrefs', 'argument', 'is_ancestor',
+              'has_interface')
+# Bits of the member flags
+MEMBER_FLAGS = ('is_public', 'is_abstract', 'is_manual_update', 'is_calculated', 'uses_argument', 'type_is_native',
+                'is_duplicate', 'arr2_dynamic')
+
+# Opcodes, the binary operators follow these in the order of OPERATORS
+OP_NAME = 0 # push the value of the name (string operand)
+OP_INT = 1 # push the operand
+OP_EMPTY = 2 # push the empty string literal
+OP_NOT = 3 # replace the top value by its negation
+# && and || short-circuit like nifxml.Expression.eval(): the left operand is followed by a jump
+# over the right operand and the OP_BOOL after it, taken if the left operand decides the result
+OP_AND = 4 # if the top value is false replace it by 0 and skip the operand instructions, else pop it
+OP_OR = 5 # if the top value is true replace it by 1 and skip the operand instructions, else pop it
+OP_BOOL = 6 # replace the top value by 1 if it is true, else 0
+OP_BINARY = 8
+OPERATORS = ('*', '/', '+', '-', '>=', '<=', '>', '<', '==', '!=', '&', '|')
+
+# Evaluation of each binary operator, with the same results as nifxml.Expression.eval()
+OPERATIONS = (
+    lambda a, b: a * b, lambda a, b: a / b, lambda a, b: a + b, lambda a, b: a - b,
+    lambda a, b: int(a >= b), lambda a, b: int(a <= b), lambda a, b: int(a > b), lambda a, b: int(a < b),
+    lambda a, b: int(a == b), lambda a, b: int(a != b), lambda a, b: a & b, lambda a, b: a | b,
+)
+
+
+class _Writer:
+    """Collects the records of a schema, see export_schema()."""
+    def __init__(self, schema):
+        self.strings = {'': 0} # type: Dict[str, int]
+        self.type_index = {} # type: Dict[Tuple[str, str], int]
+        self.types = [] # type: List[bytes]
+        self.members = [] # type: List[bytes]
+        self.options = [] # type: List[bytes]
+        self.expressions = [] # type: List[bytes]
+        self.expression_index = {} # type: Dict[int, int]
+        self.code = [] # type: List[bytes]
+        self.schema = schema
+        self.tables = (schema.types_basic, schema.types_enum, schema.types_flag, schema.types_compound,
+                       schema.types_block)
+        self.names = (schema.names_basic, schema.names_enum, schema.names_flag, schema.names_compound,
+                      schema.names_block)
+        for kind, names in enumerate(self.names):
+            for name in names:
+                self.type_index[(KINDS[kind], name)] = len(self.type_index)
+
+    def string(self, text): # type: (Optional[str]) -> int
+        """Returns the index of a string in the string table, adding it if needed."""
+        if text is None:
+            return NONE
+        try:
+            return self.strings[text]
+        except KeyError:
+            index = self.strings[text] = len(self.strings)
+            return index
+
+    def resolve(self, name, kinds): # type: (str, Tuple[str, ...]) -> int
+        """Returns the index of the type of the first of kinds with a name, as the loader looks them up."""
+        for kind in kinds:
+            index = self.type_index.get((kind, name))
+            if index is not None:
+                return index
+        return NONE
+
+    def expression(self, expr): # type: (nifxml.Expression) -> int
+        """Returns the index of an expression, compiling it to postfix code the first time."""
+        if not expr.lhs:
+            return NONE
+        # members share the expressions parsed from the same text
+        index = self.expression_index.get(id(expr))
+        if index is None:
+            start = len(self.code)
+            self.compile(expr)
+            index = self.expression_index[id(expr)] = len(self.expressions)
+            self.expressions.append(EXPRESSION.pack(self.string(str(expr)), start, len(self.code) - start))
+        return index
+
+    def compile(self, term):
+        """Appends the postfix code of a sub-expression or terminal."""
+        if not isinstance(term, str) and not isinstance(term, int):
+            self.compile(term.lhs)
+            if not term.op:
+                return
+            if term.op == '!':
+                self.code.append(INSTRUCTION.pack(OP_NOT, 0))
+                return
+            if term.op in ('&&', '||'):
+                jump = len(self.code)
+                self.code.append(None)
+                self.compile(term.rhs)
+                self.code.append(INSTRUCTION.pack(OP_BOOL, 0))
+                self.code[jump] = INSTRUCTION.pack(OP_AND if term.op == '&&' else OP_OR, len(self.code) - jump - 1)
+                return
+            self.compile(term.rhs)
+            self.code.append(INSTRUCTION.pack(OP_BINARY + OPERATORS.index(term.op), 0))
+        elif isinstance(term, int):
+            self.code.append(INSTRUCTION.pack(OP_INT, term))
+        elif term == '""':
+            self.code.append(INSTRUCTION.pack(OP_EMPTY, 0))
+        elif term.isdigit():
+            self.code.append(INSTRUCTION.pack(OP_INT, int(term)))
+        elif term.startswith('0x'):
+            self.code.append(INSTRUCTION.pack(OP_INT, int(term, 16)))
+        else:
+            self.code.append(INSTRUCTION.pack(OP_NAME, self.string(term)))
+
+    def add_type(self, kind, instance):
+        """Appends a type with its members and options."""
+        flags = sum(1 << bit for bit, attr in enumerate(TYPE_FLAGS) if getattr(instance, attr, False))
+        inherit = getattr(instance, 'inherit', None)
+        members = getattr(instance, 'members', [])
+        first_member = len(self.members)
+        member_index = {id(mem): first_member + i for i, mem in enumerate(members)}
+        for mem in members:
+            self.add_member(mem, member_index)
+        first_option = len(self.options)
+        for option in instance.options:
+            self.options.append(OPTION.pack(
+                self.string(option.name), self.string(option.description), self.string(option.cname),
+                self.string(str(option.value)), int(option.bit) if kind == 'bitflags' else -1))
+        storage = getattr(instance, 'storage', None) if kind in ('enum', 'bitflags') else None
+        self.types.append(TYPE.pack(
+            KINDS.index(kind), flags, self.string(instance.name), self.string(instance.cname),
+            self.string(instance.nativetype), self.string(instance.description), self.string(instance.count),
+            self.string(storage), self.string(getattr(instance, 'prefix', None)),
+            self.type_index[('niobject', inherit.name)] if inherit else NONE,
+            first_member, len(members), first_option, len(instance.options)))
+
+    def add_member(self, mem, member_index):
+        """Appends a member, whose duplicates are found through member_index."""
+        flags = sum(1 << bit for bit, attr in enumerate(MEMBER_FLAGS) if getattr(mem, attr))
+        self.members.append(MEMBER.pack(*(
+            [self.string(text) for text in (mem.name, mem.suffix, mem.type, mem.arg, mem.template, mem.func,
+                                            mem.default, mem.orig_ver1, mem.orig_ver2, mem.description, mem.cname,
+                                            mem.ctype, mem.carg, mem.ctemplate)]
+            + [self.resolve(mem.type, KINDS[:4]), self.resolve(mem.template, KINDS) if mem.template else NONE,
+               *(-1 if number is None else number for number in (mem.ver1, mem.ver2, mem.userver, mem.userver2))]
+            + [self.expression(expr) for expr in (mem.arr1, mem.arr2, mem.cond, mem.vercond)]
+            + [member_index[id(mem.next_dup)] if mem.next_dup else NONE, flags])))
+
+    def write(self, f):
+        """Writes the collected records to a binary file."""
+        versions = [VERSION.pack(self.string(name), self.schema.types_version[name].number)
+                    for name in self.schema.names_version]
+        for kind, (types, names) in enumerate(zip(self.tables, self.names)):
+            for name in names:
+                self.add_type(KINDS[kind], types[name])
+        kind = self.string(self.schema.kind)
+
+        data = [text.encode('utf-8') for text in self.strings]
+        offsets = [0]
+        for text in data:
+            offsets.append(offsets[-1] + len(text))
+        sections = [(b''.join(STRING_OFFSET.pack(offset) for offset in offsets) + b''.join(data), len(data)),
+                    (b''.join(versions), len(versions)), (b''.join(self.types), len(self.types)),
+                    (b''.join(self.members), len(self.members)), (b''.join(self.options), len(self.options)),
+                    (b''.join(self.expressions), len(self.expressions)), (b''.join(self.code), len(self.code))]
+        header = []
+        offset = HEADER.size
+        for content, count in sections:
+            header.extend((offset, count))
+            offset += len(content)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, kind, *header))
+        for content, _ in sections:
+            f.write(content)
+
+
+def export_schema(schema, path):
+    """
+    Writes a parsed schema to a binary file, replacing it atomically, also while other processes write it.
+    @param schema: The schema, as returned by nifxml.parse_xml().
+    @type schema: nifxml.Schema
+    @param path: The file to write.
+    @type path: str
+    """
+    fd, temp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            # readable like a file opened for writing, rather than only by its owner as mkstemp() makes it
+            umask = os.umask(0)
+            os.umask(umask)
+            os.fchmod(f.fileno(), 0o666 & ~umask)
+            _Writer(schema).write(f)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+class BinarySchema:
+    """
+    A schema written by export_schema(), mapped into memory.
+    The types, members, options and expressions are views of the file, built when first asked for.
+
+    @ivar kind: 'nif' or 'kfm', the kind of XML file the schema was parsed from.
+    """
+    def __init__(self, path):
+        """
+        @param path: The file to open.
+        @type path: str
+        """
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self._map, 0)
+        if fields[0] != MAGIC or fields[1] != FORMAT_VERSION:
+            self._map.close()
+            raise ValueError("%s is not a binary schema of format version %d" % (path, FORMAT_VERSION))
+        self._sections = dict(zip(SECTIONS, zip(fields[3::2], fields[4::2])))
+        strings, count = self._sections['strings']
+        self._string_data = strings + (count + 1) * STRING_OFFSET.size
+        self._strings = [None] * count # type: List[Optional[str]]
+        self._types = [None] * self._sections['types'][1] # type: List[Optional[TypeView]]
+        self._expressions = {} # type: Dict[int, ExpressionView]
+        self._by_name = None # type: Optional[Dict[Tuple[str, str], int]]
+        self.kind = self.string(fields[2])
+
+    def close(self):
+        """
+        Unmaps the file. The views keep the attributes they were built with, but reading anything else
+        from the file raises ValueError, such as the members of a type or a string not read before.
+        """
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _record(self, section, layout, index): # type: (str, struct.Struct, int) -> Tuple[Any, ...]
+        """Reads one fixed-width record of a section."""
+        offset, count = self._sections[section]
+        if not 0 <= index < count:
+            raise IndexError("no %s record %d" % (section, index))
+        return layout.unpack_from(self._map, offset + index * layout.size)
+
+    def string(self, index): # type: (int) -> Optional[str]
+        """Returns a string of the string table, decoded on first use."""
+        if index == NONE:
+            return None
+        text = self._strings[index]
+        if text is None:
+            start, end = struct.unpack_from('<II', self._map, self._sections['strings'][0] + index * STRING_OFFSET.size)
+            text = self._strings[index] = self._map[self._string_data + start:self._string_data + end].decode('utf-8')
+        return text
+
+    def versions(self): # type: () -> List[Tuple[str, int]]
+        """Returns the number of each <version> tag as in the XML, with the packed number, in document order."""
+        return [(self.string(name), number)
+                for name, number in (self._record('versions', VERSION, i) for i in range(self._sections['versions'][1]))]
+
+    def type(self, index): # type: (int) -> TypeView
+        """Returns a type by its index in the file."""
+        view = self._types[index]
+        if view is None:
+            view = self._types[index] = TypeView(self, index)
+        return view
+
+    def types(self, kind): # type: (str) -> List[TypeView]
+        """Returns the types of a tag, such as 'compound', in document order."""
+        return [view for view in (self.type(i) for i in range(len(self._types))) if view.kind == kind]
+
+    def find(self, name, kind=None): # type: (str, Optional[str]) -> Optional[TypeView]
+        """Returns the type of a name, of the first tag it is declared by if kind is not given, else None."""
+        if self._by_name is None:
+            by_name = {}
+            for index in range(len(self._types)):
+                kind_index, _, name_index = struct.unpack_from('<BBxxI', self._map,
+                                                               self._sections['types'][0] + index * TYPE.size)
+                key = (KINDS[kind_index], self.string(name_index))
+                by_name.setdefault(key, index)
+                by_name.setdefault((None, key[1]), index)
+            self._by_name = by_name
+        index = self._by_name.get((kind, name))
+        return self.type(index) if index is not None else None
+
+    def member(self, index): # type: (int) -> MemberView
+        """Returns a member by its index in the file."""
+        return MemberView(self, index)
+
+    def expression(self, index): # type: (int) -> Optional[ExpressionView]
+        """Returns an expression by its index in the file, None for NONE."""
+        if index == NONE:
+            return None
+        view = self._expressions.get(index)
+        if view is None:
+            view = self._expressions[index] = ExpressionView(self, index)
+        return view
+
+
+class TypeView:
+    """
+    A type of a binary schema, with the attributes of nifxml.Basic and its subclasses which do not
+    refer to other types; those which do are methods.
+    """
+    __slots__ = ('_schema', 'index', 'kind', 'name', 'cname', 'nativetype', 'description', 'count', 'storage',
+                 'prefix', '_inherit', '_members', '_options') + TYPE_FLAGS
+
+    def __init__(self, schema, index):
+        self._schema = schema
+        self.index = index
+        (kind, flags, name, cname, nativetype, description, count, storage, prefix, self._inherit,
+         first_member, member_count, first_option, option_count) = schema._record('types', TYPE, index)
+        self.kind = KINDS[kind] # type: str
+        for bit, attr in enumerate(TYPE_FLAGS):
+            setattr(self, attr, bool(flags & (1 << bit)))
+        string = schema.string
+        self.name = string(name) # type: str
+        self.cname = string(cname) # type: str
+        self.nativetype = string(nativetype) # type: Optional[str]
+        self.description = string(description) # type: str
+        self.count = string(count) # type: str
+        self.storage = string(storage) # type: Optional[str]
+        self.prefix = string(prefix) # type: Optional[str]
+        self._members = range(first_member, first_member + member_count)
+        self._options = range(first_option, first_option + option_count)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.kind, self.name)
+
+    def inherit(self): # type: () -> Optional[TypeView]
+        """Returns the parent of a niobject, if any."""
+        return self._schema.type(self._inherit) if self._inherit != NONE else None
+
+    def ancestors(self): # type: () -> List[TypeView]
+        """Returns the niobject and its ancestors, nearest first."""
+        ancestors = [self]
+        while ancestors[-1].inherit():
+            ancestors.append(ancestors[-1].inherit())
+        return ancestors
+
+    def members(self): # type: () -> List[MemberView]
+        """Returns the members declared by the type itself."""
+        return [self._schema.member(i) for i in self._members]
+
+    def stream_members(self): # type: () -> List[MemberView]
+        """Returns the members of the type and its ancestors in the order they are streamed."""
+        return [mem for ancestor in reversed(self.ancestors()) for mem in ancestor.members()]
+
+    def options(self): # type: () -> List[Tuple[str, str, str, Union[str, int], Optional[int]]]
+        """
+        Returns the name, description, cname, value and bit of each option of an enum or bitflags,
+        with values as in nifxml.Option: text for an enum, the mask for bitflags.
+        """
+        options = []
+        for i in self._options:
+            name, description, cname, value, bit = self._schema._record('options', OPTION, i)
+            value = self._schema.string(value)
+            options.append((self._schema.string(name), self._schema.string(description), self._schema.string(cname),
+                            int(value) if bit >= 0 else value, bit if bit >= 0 else None))
+        return options
+
+
+class MemberView:
+    """A member of a type of a binary schema, with the attributes of nifxml.Member which describe the field."""
+    __slots__ = ('_schema', 'index', 'name', 'suffix', 'type', 'arg', 'template', 'func', 'default',
+                 'orig_ver1', 'orig_ver2', 'description', 'cname', 'ctype', 'carg', 'ctemplate', '_type', '_template',
+                 'ver1', 'ver2', 'userver', 'userver2', '_expressions', '_next_dup') + MEMBER_FLAGS
+
+    def __init__(self, schema, index):
+        self._schema = schema
+        self.index = index
+        fields = schema._record('members', MEMBER, index)
+        string = schema.string
+        (self.name, self.suffix, self.type, self.arg, self.template, self.func, self.default, self.orig_ver1,
+         self.orig_ver2, self.description, self.cname, self.ctype, self.carg, self.ctemplate) = \
+            [string(i) for i in fields[:14]]
+        self._type, self._template = fields[14:16]
+        self.ver1, self.ver2, self.userver, self.userver2 = \
+            [number if number >= 0 else None for number in fields[16:20]] # type: Optional[int]
+        self._expressions = fields[20:24]
+        self._next_dup = fields[24]
+        for bit, attr in enumerate(MEMBER_FLAGS):
+            setattr(self, attr, bool(fields[25] & (1 << bit)))
+
+    def __repr__(self):
+        return '<member %s>' % self.name
+
+    def type_obj(self): # type: () -> Optional[TypeView]
+        """Returns the type of the member, None if it is TEMPLATE or unknown."""
+        return self._schema.type(self._type) if self._type != NONE else None
+
+    def template_obj(self): # type: () -> Optional[TypeView]
+        """Returns the template argument of the member, None if there is none or it is TEMPLATE or unknown."""
+        return self._schema.type(self._template) if self._template != NONE else None
+
+    def next_dup(self): # type: () -> Optional[MemberView]
+        """Returns the next member of the same type with the same name, if any."""
+        return self._schema.member(self._next_dup) if self._next_dup != NONE else None
+
+    @property
+    def arr1(self): # type: () -> Optional[ExpressionView]
+        """The first array size, None if the member is not an array."""
+        return self._schema.expression(self._expressions[0])
+
+    @property
+    def arr2(self): # type: () -> Optional[ExpressionView]
+        """The second array size, None if the member is not a two-dimensional array."""
+        return self._schema.expression(self._expressions[1])
+
+    @property
+    def cond(self): # type: () -> Optional[ExpressionView]
+        """The condition on the data for the member to be present, None if there is none."""
+        return self._schema.expression(self._expressions[2])
+
+    @property
+    def vercond(self): # type: () -> Optional[ExpressionView]
+        """The condition on the version for the member to be present, None if there is none."""
+        return self._schema.expression(self._expressions[3])
+
+
+class ExpressionView:
+    """
+    An expression of a binary schema, as its text and its postfix code.
+    @ivar text: The expression as str() of nifxml.Expression formats it.
+    @ivar code: The (opcode, operand) instructions, see OP_NAME and the others.
+    """
+    __slots__ = ('text', 'code', '_schema')
+
+    def __init__(self, schema, index):
+        self._schema = schema
+        text, start, length = schema._record('expressions', EXPRESSION, index)
+        self.text = schema.string(text) # type: str
+        offset = schema._sections['code'][0] + start * INSTRUCTION.size
+        self.code = [INSTRUCTION.unpack_from(schema._map, offset + i * INSTRUCTION.size)
+                     for i in range(length)] # type: List[Tuple[int, int]]
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return '<expression %s>' % self.text
+
+    def get_names(self): # type: () -> List[str]
+        """Returns the distinct names read from the data, in order of appearance."""
+        names = []
+        for op, operand in self.code:
+            if op == OP_NAME:
+                name = self._schema.string(operand)
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def eval(self, data=None):
+        """
+        Evaluate the expression like nifxml.Expression.eval(), reading names as attributes of data.
+        The right operand of && and || is only evaluated if the left one does not decide the result.
+
+        >>> import tempfile, nifxml
+        >>> with tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False) as f:
+        ...     _ = f.write('''<kfmxml><version num="2.2.0.0">KF 2.2</version><basic name="uint">Int.</basic>
+        ...         <compound name="Keys"><add name="Num Keys" type="uint">Count.</add>
+        ...             <add name="Keys" type="uint" cond="Num Keys != 0 &amp;&amp; Key Type == 2">Keys.</add>
+        ...         </compound></kfmxml>''')
+        >>> schema = nifxml.parse_xml(path=f.name, cache=False, activate=False, kind=nifxml.KFM)
+        >>> export_schema(schema, f.name + '.nifs')
+        >>> class Data:
+        ...     pass
+        >>> data = Data()
+        >>> setattr(data, 'Num Keys', 0)
+        >>> with open_schema(f.name + '.nifs') as binary:
+        ...     binary.find('Keys').members()[1].cond.eval(data)
+        0
+        >>> schema.types_compound['Keys'].members[1].cond.eval(data)
+        0
+        >>> os.remove(f.name), os.remove(f.name + '.nifs')
+        (None, None)
+        """
+        stack = []
+        code = self.code
+        i = 0
+        while i < len(code):
+            op, operand = code[i]
+            i += 1
+            if op == OP_NAME:
+                stack.append(getattr(data, self._schema.string(operand)))
+            elif op == OP_INT:
+                stack.append(operand)
+            elif op == OP_EMPTY:
+                stack.append("")
+            elif op == OP_NOT:
+                stack.append(not stack.pop())
+            elif op == OP_AND or op == OP_OR:
+                if bool(stack[-1]) == (op == OP_OR):
+                    stack[-1] = int(op == OP_OR)
+                    i += operand
+                else:
+                    stack.pop()
+            elif op == OP_BOOL:
+                stack.append(int(bool(stack.pop())))
+            else:
+                right = stack.pop()
+                stack.append(OPERATIONS[op - OP_BINARY](stack.pop(), right))
+        return stack.pop()
+
+
+def open_schema(path): # type: (str) -> BinarySchema
+    """Opens a schema written by export_schema()."""
+    return BinarySchema(path)
+
+
+def main():
+    """Parses nif.xml or kfm.xml and writes it as a binary schema"""
+    # only here, readers of the schema start faster without it
+    import argparse
+    import nifxml
+
+    parser = argparse.ArgumentParser(description="NIF Format XML Binary Schema Exporter")
+    parser.add_argument('output', help="The binary schema file to write.")
+    parser.add_argument('-p', '--path', help="The path to nif.xml or kfm.xml.")
+    parser.add_argument('-k', '--kfm', action='store_true', help="Parse kfm.xml instead of nif.xml.")
+    args = parser.parse_args()
+
+    schema = nifxml.parse_xml(path=args.path, kind=nifxml.KFM if args.kfm else nifxml.NIF, activate=False)
+    export_schema(schema, args.output)
+
+
+if __name__ == '__main__':
+    main()
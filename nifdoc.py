@@ -25,12 +25,13 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 
 import re
+import sys
 import os
 import io
 import argparse
 from shutil import copy2
 
-from nifxml import Compound, Block, Enum, parse_xml, version2number
+from nifxml import Compound, Block, Enum, parse_xml
 from nifxml import TYPES_BLOCK, TYPES_BASIC, TYPES_COMPOUND, TYPES_ENUM, TYPES_FLAG, TYPES_VERSION
 from nifxml import NAMES_BLOCK, NAMES_BASIC, NAMES_COMPOUND, NAMES_ENUM, NAMES_FLAG, NAMES_VERSION
 
@@ -53,8 +54,11 @@ def clean(string):
 
 def main():
     """Parses the XML and generates all doc pages"""
-    # Parse the XML and sort names
-    parse_xml()
+    # Parse the XML, stopping if a reference in it does not resolve, and sort names
+    try:
+        schema = parse_xml(strict=True)
+    except ValueError as e:
+        sys.exit(str(e))
     NAMES_BASIC.sort()
     NAMES_COMPOUND.sort()
     NAMES_BLOCK.sort()
@@ -87,7 +91,7 @@ def main():
         minver = args.minimum_version
 
     # Create the document generator
-    doc = DocGenerator(root_dir + DOC_PATH, heading, metadata, version2number(minver))
+    doc = DocGenerator(schema, root_dir + DOC_PATH, heading, metadata, schema.version_number(minver))
     # Generate NiObject Pages
     doc.gen_pages(NAMES_BLOCK, TYPES_BLOCK, tmpl.NIOBJECT if metadata else tmpl.NIOBJECT_NO_META)
     # Generate Compound Pages
@@ -115,14 +119,14 @@ def main():
 class DocGenerator():
     """Methods for formatting and outputting the template strings with data from the XML"""
 
-    def __init__(self, path, heading=True, metadata=True, minver=0):
+    def __init__(self, schema, path, heading=True, metadata=True, minver=0):
         """Initialize generator"""
+        self.schema = schema
         self.doc_file = path + DOC_FILE
         self.main = tmpl.MAIN_H1 if heading else tmpl.MAIN_NO_H1
         self.attr_row = tmpl.ATTR if metadata else tmpl.ATTR_NO_META
         self.inherit = tmpl.INHERIT_ROW if metadata else tmpl.INHERIT_NO_META
         self.minver = minver
-        self.blocks = dict(TYPES_BLOCK, **TYPES_COMPOUND)
         install_dir = os.path.abspath(path)
         if not os.path.exists(install_dir):
             os.makedirs(install_dir)
@@ -191,20 +195,19 @@ class DocGenerator():
             choice_list += tmpl.ENUM_ROW.format(**content)
         return choice_list
 
-    @staticmethod
-    def list_child_blocks(block):
+    def child_blocks(self, block):
+        """The blocks directly inheriting block, sorted by name"""
+        return sorted(self.schema.children.get(block.name, []), key=lambda child: child.name)
+
+    def list_child_blocks(self, block):
         """Create Child Block list"""
-        return ''.join(tmpl.LI_LINK.format(clean(n), n) for n in NAMES_BLOCK if TYPES_BLOCK[n].inherit == block)
+        return ''.join(tmpl.LI_LINK.format(clean(c.name), c.name) for c in self.child_blocks(block))
 
     def member_of(self, name):
         """Create Member Of list"""
-        found = ''
-        for b_name in NAMES_BLOCK + NAMES_COMPOUND:
-            for bmem in self.blocks[b_name].members:
-                if bmem.type == name:
-                    found += tmpl.LI_LINK.format(clean(b_name), b_name)
-                    break
-        return found
+        # Blocks then compounds, each sorted by name
+        users = sorted(self.schema.users.get(name, []), key=lambda c: (not isinstance(c, Block), c.name))
+        return ''.join(tmpl.LI_LINK.format(clean(c.name), c.name) for c in users)
 
     def list_ancestor_attributes(self, block):
         """Create list of attributes for all ancestors"""
@@ -222,7 +225,7 @@ class DocGenerator():
         # Add a new list for this ancestor
         tree += tmpl.LI_LINK_DESC.format(clean(root.name), root.name, '' if not lines else lines[0])
         # Create Child List
-        children = [TYPES_BLOCK[n] for n in NAMES_BLOCK if TYPES_BLOCK[n].inherit == root]
+        children = self.child_blocks(root)
         if children:
             tree += tmpl.UL_ITEM.format(''.join(self.list_object_tree(c) for c in children))
         return tree
@@ -0,0 +1,526 @@
+#!/usr/bin/python3
+"""
+nifserve.py
+
+Keeps parsed schemas loaded in a daemon, which runs the generators and answers queries for thin clients
+over a Unix domain socket, so they pay neither the start of an interpreter with nifxml nor the parse of nif.xml.
+
+Each script the daemon runs gets a process forked from it, with the standard streams, working directory,
+environment and arguments of the client. Its parse_xml() calls find the schemas the daemon holds,
+see nifxml.RESIDENT, and the daemon loads any schema a script had to parse for the next one.
+The daemon reloads a schema when its XML file changes. Without a daemon, the clients run the script
+or answer the query in their own process.
+
+Clients pass their environment and standard streams to the daemon, so only the user running it may talk to it:
+the socket is created in $XDG_RUNTIME_DIR or in a directory of the user only they may enter, and each side checks
+that the other runs as the same user before reading or sending a request.
+
+    nifserve.py serve &
+    nifserve.py run gen_niflib.py -p ../niflib
+    nifserve.py query NiNode -v 20.2.0.7
+    nifserve.py stop
+
+To list command line options run:
+    nifserve.py -h
+
+This file is part of nifxml <https://www.github.com/niftools/nifxml>
+Copyright (c) 2017-2020 NifTools
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gc
+import os
+import sys
+import json
+import stat
+import array
+import runpy
+import select
+import socket
+import struct
+import tempfile
+import traceback
+
+# If set, the socket the daemon listens on and the clients connect to
+SOCKET_VARIABLE = 'NIFXML_SOCKET'
+
+# The socket in the runtime directory of the user, or in a directory of the user in the temporary directory
+SOCKET_FILE = 'nifxml.sock'
+SOCKET_DIRECTORY = 'nifxml-%d'
+
+# Seconds between checks of the XML files of the loaded schemas for changes
+POLL_SECONDS = 1.0
+
+# The standard streams a client passes to the scripts run for it
+STREAMS = 3
+
+
+def socket_path(): # type: () -> str
+    """Returns the socket of the daemon of this user, see SOCKET_VARIABLE and SOCKET_FILE."""
+    if os.environ.get(SOCKET_VARIABLE):
+        return os.environ[SOCKET_VARIABLE]
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(),
+                                                                  SOCKET_DIRECTORY % os.getuid())
+    return os.path.join(directory, SOCKET_FILE)
+
+
+def _check_socket(path): # type: (str) -> None
+    """
+    Raises PermissionError unless a socket belongs to this user and no one else may use it, in a directory
+    no one else may replace it in: one of this user or root, which others may not write to, or only with
+    the sticky bit set, like /tmp. Raises FileNotFoundError if there is no socket.
+    """
+    status = os.lstat(path)
+    if not stat.S_ISSOCK(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0o077:
+        raise PermissionError("%s is not a socket of this user only" % path)
+    directory = os.path.dirname(os.path.abspath(path))
+    status = os.stat(directory)
+    if status.st_uid not in (os.getuid(), 0) or (status.st_mode & 0o022 and not status.st_mode & stat.S_ISVTX):
+        raise PermissionError("others may replace the socket in %s" % directory)
+
+
+def _peer_user(conn): # type: (socket.socket) -> Optional[int]
+    """Returns the user of the process at the other end of a connection, None if the platform does not tell."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = struct.Struct('3i')
+    _, uid, _ = credentials.unpack(conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size))
+    return uid
+
+
+def _send(conn, message, fds=()): # type: (socket.socket, Dict[str, Any], Sequence[int]) -> None
+    """Sends a message as a line of JSON, passing file descriptors along with it."""
+    data = json.dumps(message).encode('utf-8') + b'\n'
+    ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))] if fds else []
+    sent = conn.sendmsg([data], ancillary)
+    if sent < len(data):
+        conn.sendall(data[sent:])
+
+
+def _take(conn, fds): # type: (socket.socket, array.array) -> bytes
+    """Receives what arrived of a message sent by _send(), adding the file descriptors passed with it to fds."""
+    chunk, ancillary, _, _ = conn.recvmsg(65536, socket.CMSG_LEN(STREAMS * fds.itemsize))
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[:len(payload) - len(payload) % fds.itemsize])
+    return chunk
+
+
+def _receive(conn): # type: (socket.socket) -> Tuple[Optional[Dict[str, Any]], List[int]]
+    """Receives a message sent by _send() and the file descriptors passed with it. None if the peer hung up."""
+    data = b''
+    fds = array.array('i')
+    while not data.endswith(b'\n'):
+        chunk = _take(conn, fds)
+        if not chunk:
+            return None, list(fds)
+        data += chunk
+    return json.loads(data.decode('utf-8')), list(fds)
+
+
+def _load(request): # type: (Dict[str, Any]) -> nifxml.Schema
+    """Parses, or finds loaded, the schema a query asks about, relative to the working directory of the client."""
+    import nifxml
+    kind = request.get('kind') or nifxml.NIF
+    # the daemon answers queries itself, so it keeps its own working directory
+    path = os.path.abspath(nifxml.find_xml(request.get('path'), kind, request.get('cwd')))
+    return nifxml.parse_xml(path=path, kind=kind, activate=False)
+
+
+def answer(request): # type: (Dict[str, Any]) -> Dict[str, Any]
+    """
+    Answers a query: the names of the types of each tag, or with a name, the fields of that compound or niobject
+    and its ancestors. With a version, only the fields which exist in it, as Schema.view() has them.
+    """
+    schema = _load(request)
+    name = request.get('name')
+    if not name:
+        return {'types': {'basic': schema.names_basic, 'enum': schema.names_enum, 'bitflags': schema.names_flag,
+                          'compound': schema.names_compound, 'niobject': schema.names_block}}
+    compound = schema.types_block.get(name) or schema.types_compound.get(name)
+    if compound is None:
+        return {'error': "no compound or niobject named '%s'" % name}
+    version = request.get('version')
+    if version is not None:
+        view = schema.view(version, request.get('userver', 0), request.get('userver2', 0))
+        members = view.inherited_members(name) if name in schema.types_block else view.members[name]
+    else:
+        members = compound.stream_members()
+    fields = []
+    for mem in members:
+        field = {'name': mem.name, 'type': mem.type}
+        for attr in ('template', 'arg', 'arr1', 'arr2', 'cond', 'vercond'):
+            value = str(getattr(mem, attr))
+            if value:
+                field[attr] = value
+        # a view has no version checks left
+        if version is None:
+            for attr in ('orig_ver1', 'orig_ver2', 'userver', 'userver2'):
+                if getattr(mem, attr):
+                    field[attr.replace('orig_', '')] = getattr(mem, attr)
+        fields.append(field)
+    inherit = getattr(compound, 'inherit', None)
+    return {'name': compound.name, 'inherit': inherit.name if inherit else None, 'fields': fields}
+
+
+def _run(script, argv): # type: (str, List[str]) -> int
+    """Runs a script as __main__ in this process, and returns its exit status."""
+    sys.argv = [script] + list(argv)
+    sys.path[0] = os.path.dirname(os.path.abspath(script))
+    try:
+        runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException: # pylint: disable=broad-except
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    return 0
+
+
+class SchemaServer:
+    """
+    The daemon: keeps schemas loaded, runs scripts in processes forked from it, and answers queries.
+    @ivar path: The socket it listens on.
+    @ivar loads: The arguments of parse_xml() of each schema loaded, with the modification time of its XML file.
+    @ivar running: The connection of the client and the pipe reporting new schemas of each script running, by pid.
+    @ivar receiving: What arrived of its request, and the file descriptors passed with it, of each client which
+        has not sent all of it: the daemon reads requests as they arrive, so a client which stalls stalls no other.
+    """
+    def __init__(self, path=None):
+        self.path = os.path.abspath(path or socket_path()) # type: str
+        self.loads = {} # type: Dict[str, Tuple[Dict[str, Any], float]]
+        self.running = {} # type: Dict[int, Tuple[socket.socket, int]]
+        self.receiving = {} # type: Dict[socket.socket, Tuple[bytearray, array.array]]
+        self._listener = None # type: Optional[socket.socket]
+        self._stopping = False
+
+    def serve_forever(self):
+        """Listens on the socket until asked to stop."""
+        import nifxml
+        nifxml.RESIDENT = {}
+        self._listener = self._listen()
+        try:
+            while not self._stopping:
+                pipes = {pipe: pid for pid, (_, pipe) in self.running.items()}
+                readable, _, _ = select.select([self._listener] + list(self.receiving) + list(pipes), [], [],
+                                               POLL_SECONDS)
+                for ready in readable:
+                    if ready is self._listener:
+                        self._accept()
+                    elif ready in self.receiving:
+                        self._read(ready)
+                    else:
+                        self._finish(pipes[ready])
+                self._reload()
+        finally:
+            self._listener.close()
+            for conn in list(self.receiving):
+                self._drop(conn)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _listen(self): # type: () -> socket.socket
+        """
+        Binds the socket, replacing one no daemon listens on any more, and creating its directory
+        for this user only if needed.
+        """
+        os.makedirs(os.path.dirname(self.path), 0o700, exist_ok=True)
+        if os.path.lexists(self.path):
+            if _connect(self.path) is not None:
+                raise OSError("a daemon already listens on %s" % self.path)
+            os.remove(self.path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # no one else may connect, not even before the socket is listened on
+        umask = os.umask(0o177)
+        try:
+            listener.bind(self.path)
+        finally:
+            os.umask(umask)
+        _check_socket(self.path)
+        listener.listen()
+        return listener
+
+    def _accept(self):
+        """Accepts a connection of this user, whose request _read() then reads as it arrives."""
+        conn, _ = self._listener.accept()
+        if _peer_user(conn) not in (None, os.getuid()):
+            conn.close()
+            return
+        conn.setblocking(False)
+        self.receiving[conn] = (bytearray(), array.array('i'))
+
+    def _read(self, conn):
+        """Reads what arrived of a request without waiting for the rest, and serves it once all of it has."""
+        data, fds = self.receiving[conn]
+        try:
+            chunk = _take(conn, fds)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b''
+        if not chunk:
+            self._drop(conn)
+            return
+        data += chunk
+        if not data.endswith(b'\n'):
+            return
+        del self.receiving[conn]
+        conn.setblocking(True)
+        try:
+            request = json.loads(data.decode('utf-8'))
+        except ValueError:
+            request = None
+        self._handle(conn, request if isinstance(request, dict) else None, list(fds))
+
+    def _drop(self, conn):
+        """Closes the connection of a client which hung up before sending all of its request."""
+        _, fds = self.receiving.pop(conn)
+        for fd in fds:
+            os.close(fd)
+        conn.close()
+
+    def _handle(self, conn, request, fds):
+        """Serves one request, leaving the connection open if a script runs for it."""
+        try:
+            command = request.get('command') if request else None
+            if command == 'run' and len(fds) == STREAMS:
+                self._start(conn, request, fds)
+                return
+            if command == 'query':
+                reply = self._query(request)
+            elif command == 'status':
+                reply = {'pid': os.getpid(), 'schemas': sorted(args['path'] for args, _ in self.loads.values())}
+            elif command == 'stop':
+                self._stopping = True
+                reply = {'stopped': True}
+            else:
+                reply = {'error': "unknown request %r" % (command,)}
+            try:
+                _send(conn, reply)
+            except OSError:
+                pass # the client gave up
+            conn.close()
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def _query(self, request): # type: (Dict[str, Any]) -> Dict[str, Any]
+        """Answers a query, remembering the schema it loaded."""
+        import nifxml
+        known = set(nifxml.RESIDENT)
+        try:
+            reply = answer(request)
+        except (ImportError, KeyError, ValueError, OSError) as e:
+            reply = {'error': str(e)}
+        self._remember(nifxml.RESIDENT[key] for key in set(nifxml.RESIDENT) - known)
+        return reply
+
+    def _start(self, conn, request, fds):
+        """Forks a process running a script for a client, with its streams, directory and environment."""
+        import nifxml
+        read, write = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            os.close(write)
+            self.running[pid] = (conn, read)
+            return
+        status = 1
+        try:
+            # the collector of the script then leaves the schemas it shares copy-on-write alone, while
+            # that of the daemon still frees those it drops
+            gc.freeze()
+            os.close(read)
+            self._listener.close()
+            for other, pipe in self.running.values():
+                other.close()
+                os.close(pipe)
+            for other, (_, passed) in self.receiving.items():
+                other.close()
+                for fd in passed:
+                    os.close(fd)
+            conn.close()
+            for stream, fd in enumerate(fds):
+                os.dup2(fd, stream)
+            os.chdir(request.get('cwd', '.'))
+            os.environ.clear()
+            os.environ.update(request.get('env', {}))
+            known = set(nifxml.RESIDENT)
+            status = _run(request['script'], request.get('argv', []))
+            # the schemas the script had to parse, for the daemon to load for the next
+            with os.fdopen(write, 'w') as report:
+                for key in set(nifxml.RESIDENT) - known:
+                    json.dump(self._arguments(nifxml.RESIDENT[key]), report)
+                    report.write('\n')
+        finally:
+            os._exit(status)
+
+    def _finish(self, pid):
+        """Reports the exit status of a script to its client, and loads the schemas it parsed."""
+        conn, pipe = self.running.pop(pid)
+        with os.fdopen(pipe) as report:
+            parsed = [json.loads(line) for line in report if line.strip()]
+        _, status = os.waitpid(pid, 0)
+        try:
+            _send(conn, {'status': os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode')
+                                   else status >> 8})
+        except OSError:
+            pass # the client gave up
+        conn.close()
+        for args in parsed:
+            self._parse(args)
+
+    @staticmethod
+    def _arguments(schema): # type: (nifxml.Schema) -> Dict[str, Any]
+        """Returns the arguments of parse_xml() which load a schema again."""
+        return {'path': os.path.abspath(schema.path), 'ntypes': schema.ntypes, 'kind': schema.kind,
+                'roots': sorted(schema.roots) if schema.roots is not None else None}
+
+    def _parse(self, args): # type: (Dict[str, Any]) -> None
+        """Loads a schema, from the cache file of the script which parsed it if it is still there."""
+        import nifxml
+        known = set(nifxml.RESIDENT)
+        try:
+            nifxml.parse_xml(args['ntypes'], args['path'], roots=args['roots'], kind=args['kind'], activate=False)
+        except (ImportError, KeyError, ValueError, OSError):
+            return
+        self._remember(nifxml.RESIDENT[key] for key in set(nifxml.RESIDENT) - known)
+
+    def _remember(self, schemas): # type: (Iterable[nifxml.Schema]) -> None
+        """Watches the XML files of newly loaded schemas."""
+        import nifxml
+        for schema in schemas:
+            args = self._arguments(schema)
+            key = nifxml.cache_file(args['path'], args['ntypes'], schema.roots)
+            self.loads[key] = (args, os.stat(args['path']).st_mtime)
+
+    def _reload(self):
+        """Loads again the schemas whose XML file changed, and forgets those whose file is gone."""
+        import nifxml
+        for key, (args, mtime) in list(self.loads.items()):
+            try:
+                changed = os.stat(args['path']).st_mtime != mtime
+            except OSError:
+                changed = True
+            if changed:
+                del self.loads[key]
+                nifxml.RESIDENT.pop(key, None)
+                if os.path.exists(args['path']):
+                    self._parse(args)
+
+
+def _connect(path=None): # type: (Optional[str]) -> Optional[socket.socket]
+    """
+    Connects to the daemon, None if there is none. Raises PermissionError if the socket or the process
+    listening on it is not of this user, see _check_socket().
+    """
+    path = path or socket_path()
+    try:
+        _check_socket(path)
+    except FileNotFoundError:
+        return None
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        conn.close()
+        return None
+    if _peer_user(conn) not in (None, os.getuid()):
+        conn.close()
+        raise PermissionError("the daemon on %s runs as another user" % path)
+    return conn
+
+
+def request(message, fds=(), path=None): # type: (Dict[str, Any], Sequence[int], Optional[str]) -> Optional[Dict[str, Any]]
+    """Sends a request to the daemon and returns its reply, None if there is no daemon."""
+    conn = _connect(path)
+    if conn is None:
+        return None
+    with conn:
+        _send(conn, message, fds)
+        reply, _ = _receive(conn)
+    if reply is None:
+        raise ConnectionError("the daemon hung up")
+    return reply
+
+
+def run_script(script, argv, path=None): # type: (str, List[str], Optional[str]) -> int
+    """
+    Runs a script, such as gen_niflib.py or nifdoc.py, in the daemon if there is one, else in this process,
+    with the standard streams, working directory and environment of this process. Returns its exit status.
+    """
+    script = os.path.abspath(script)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    reply = request({'command': 'run', 'script': script, 'argv': list(argv), 'cwd': os.getcwd(),
+                     'env': dict(os.environ)}, list(range(STREAMS)), path)
+    if reply is None:
+        return _run(script, argv)
+    return reply['status']
+
+
+def query(name=None, xml=None, kind=None, version=None, path=None):
+    # type: (Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]) -> Dict[str, Any]
+    """Answers a query, see answer(), in the daemon if there is one, else in this process."""
+    message = {'command': 'query', 'name': name, 'path': xml, 'kind': kind, 'version': version, 'cwd': os.getcwd()}
+    reply = request(message, path=path)
+    return reply if reply is not None else answer(message)
+
+
+def main():
+    """Runs the daemon, or a client of it"""
+    import argparse
+    parser = argparse.ArgumentParser(description="NIF Format XML Schema Daemon")
+    parser.add_argument('-s', '--socket', help="The socket of the daemon, defaults to $%s, else %s in "
+                                               "$XDG_RUNTIME_DIR or in a directory of the user in %s."
+                                               % (SOCKET_VARIABLE, SOCKET_FILE, tempfile.gettempdir()))
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('serve', help="Run the daemon until stopped.")
+    commands.add_parser('stop', help="Stop the daemon.")
+    commands.add_parser('status', help="Print the schemas the daemon holds.")
+    run = commands.add_parser('run', help="Run a script, in the daemon if there is one.")
+    run.add_argument('script', help="The script, such as gen_niflib.py or nifdoc.py.")
+    run.add_argument('args', nargs=argparse.REMAINDER, help="The arguments of the script.")
+    ask = commands.add_parser('query', help="Print the types, or the fields of one, as JSON.")
+    ask.add_argument('name', nargs='?', help="The compound or niobject.")
+    ask.add_argument('-p', '--path', help="The XML file, defaults to nif.xml.")
+    ask.add_argument('-k', '--kind', choices=['nif', 'kfm'], help="The kind of XML file.")
+    ask.add_argument('-v', '--version', help="Only the fields which exist in this version.")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        SchemaServer(args.socket).serve_forever()
+    elif args.command in ('stop', 'status'):
+        reply = request({'command': args.command}, path=args.socket)
+        print(json.dumps(reply) if reply is not None else "no daemon listens on %s" % (args.socket or socket_path()))
+    elif args.command == 'run':
+        sys.exit(run_script(args.script, args.args, args.socket))
+    elif args.command == 'query':
+        reply = query(args.name, args.path, args.kind, args.version, args.socket)
+        print(json.dumps(reply, indent=1))
+        if 'error' in reply:
+            sys.exit(1)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -50,14 +50,28 @@ This file incorporates work covered by the following copyright and permission no
  POSSIBILITY OF SUCH DAMAGE.
 """
 
-from xml.dom.minidom import Node, parse
+from xml.etree.ElementTree import iterparse, parse
 
+import copy
+import gc
+import hashlib
+import json
+import multiprocessing
 import os
+import pickle
 import re
+import string
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
 
 #
 # Globals
 #
+# A view of the tables of the active Schema, kept for the code generators.
+# Schema.activate() refills them in place, so names imported from this module stay valid.
 
 TYPES_NATIVE = {'TEMPLATE': 'T'}
 TYPES_BASIC = {}
@@ -74,88 +88,132 @@ NAMES_FLAG = []
 NAMES_BLOCK = []
 NAMES_VERSION = []
 
+# Tags of compound and block members, kfm.xml still uses the older <add>
+FIELD_TAGS = ('field', 'add')
 
-def class_name(name_in): # type: (str) -> str
+# The expression terminals which are known from the version of the file alone
+VERSION_TERMINALS = ('Version', 'User Version', 'User Version 2')
+
+# The attributes of a member which hold an expression over other members
+EXPRESSION_ATTRIBUTES = ('arr1', 'arr2', 'cond', 'vercond')
+
+# Parsed tables are pickled here, keyed by the path of the XML, its contents and this loader,
+# and the native type mapping and roots
+CACHE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '__pycache__')
+CACHE_FILE = 'nifxml-{}-{}-{}.pickle'
+
+# The most caches kept per XML file, for different native type mappings or roots
+CACHE_VARIANTS = 4
+
+# If set, the name of a file each parse_xml() appends its Profile to, as a line of JSON
+PROFILE_VARIABLE = 'NIFXML_PROFILE'
+
+# The fewest compounds and blocks worth sending to worker processes, which return them pickled, see
+# 'nifbench.py parallel'. Building one takes about 0.09 ms, but the parent still takes 0.05 ms to unpickle it
+# and 0.02 ms to share and resolve it, so even with every build overlapped the 0.02 ms saved per type
+# only pays for the 30 ms of starting the workers from about 2000 types, more than nif.xml has.
+PARALLEL_MIN_TYPES = 2000
+
+# Schemas kept in memory by the cache file they would be stored in, for parse_xml() to reuse before the cache.
+# None unless a process keeps schemas loaded for the processes it forks, see nifserve.py.
+RESIDENT = None # type: Optional[Dict[str, Schema]]
+
+
+# Bound on the names remembered by each name formatter
+NAME_CACHE_SIZE = 8192
+
+# Characters replaced in class names
+CLASS_NAME_TABLE = str.maketrans(' :', '__')
+# Tokens of member names: spaces with the character after them, runs of letters and digits, anything else
+MEMBER_NAME_TOKENS = re.compile(r' [ \\]*[^\W_]?|[^\W_]+|.', re.DOTALL)
+# Positions of define names where an underscore goes: before each (ASCII) capital but the first character
+DEFINE_NAME_CAPS = re.compile(r'(?<=.)(?=[A-Z])', re.DOTALL)
+# Characters replaced in define names
+DEFINE_NAME_OTHER = re.compile(r'[\W_]')
+
+
+def class_name(name_in, types_native=None): # type: (str, Optional[Dict[str, str]]) -> str
     """
     Formats a valid C++ class name from the name format used in the XML.
+    Native types are looked up in types_native, by default those of the active schema.
+
+    >>> class_name('BS Bound:Box', {})
+    'BS_Bound_Box'
+    >>> class_name('TEMPLATE')
+    'T'
     """
     if name_in is None:
         return None
-    try:
-        return TYPES_NATIVE[name_in]
-    except KeyError:
-        return name_in.replace(' ', '_').replace(":", "_")
+    native = (TYPES_NATIVE if types_native is None else types_native).get(name_in)
+    return native if native is not None else _class_name(name_in)
 
-    if name_in is None:
-        return None
-    try:
-        return TYPES_NATIVE[name_in]
-    except KeyError:
-        pass
-    if name_in == 'TEMPLATE':
-        return 'T'
-    name_out = ''
-    for i, char in enumerate(name_in):
-        if char.isupper():
-            if i > 0:
-                name_out += '_'
-            name_out += char.lower()
-        elif char.islower() or char.isdigit():
-            name_out += char
-        else:
-            name_out += '_'
-    return name_out
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def _class_name(name_in): # type: (str) -> str
+    """class_name of a type which is not native"""
+    return name_in.translate(CLASS_NAME_TABLE)
 
+@lru_cache(maxsize=NAME_CACHE_SIZE)
 def define_name(name_in): # type: (str) -> str
     """
     Formats an all-uppercase version of the name for use in C++ defines.
-    """
-    name_out = ''
-    for i, char in enumerate(name_in):
-        if char.isupper():
-            if i > 0:
-                name_out += '_'
-                name_out += char
-            else:
-                name_out += char
-        elif char.islower() or char.isdigit():
-            name_out += char.upper()
-        else:
-            name_out += '_'
-    return name_out
 
+    >>> define_name('NiTriShape')
+    'NI_TRI_SHAPE'
+    >>> define_name('bhkRigidBody_T')
+    'BHK_RIGID_BODY__T'
+    >>> define_name('Unknown 2-Bytes')
+    'UNKNOWN_2__BYTES'
+    """
+    return DEFINE_NAME_OTHER.sub('_', DEFINE_NAME_CAPS.sub('_', name_in)).upper()
+
+def _member_token(match): # type: (Match) -> str
+    """Formats one token of a member name."""
+    token = match.group()
+    if token[0] == ' ':
+        # the first letter or digit after a space is capitalized, and backslashes access members of the arg
+        return token.replace(' ', '').replace('\\', '.').upper()
+    if token[0].isalnum():
+        return token.lower()
+    return '.' if token == '\\' else '_'
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
 def member_name(name_in): # type: (str) -> str
     """
     Formats a version of the name for use as a C++ member variable.
+
+    >>> member_name('Num Vertices')
+    'numVertices'
+    >>> member_name('Has UV Sets')
+    'hasUvSets'
+    >>> member_name('ARG\\\\Num Keys')
+    'arg.numKeys'
+    >>> member_name('Unknown 2-Bytes')
+    'unknown2_bytes'
+    >>> member_name('Sub \\\\ Field (Old)')
+    'sub.Field_old_'
+    >>> member_name(' Leading  Space ')
+    'LeadingSpace'
     """
     if name_in is None or name_in == 'ARG':
         return name_in
-    name_out = ''
-    lower = True
-    for char in name_in:
-        if char == ' ':
-            lower = False
-        elif char.isalnum():
-            if lower:
-                name_out += char.lower()
-            else:
-                name_out += char.upper()
-                lower = True
-        elif char == '\\': # arg member access operator
-            name_out += '.'
-        else:
-            name_out += '_'
-            lower = True
-    return name_out
+    return MEMBER_NAME_TOKENS.sub(_member_token, name_in)
 
+@lru_cache(maxsize=NAME_CACHE_SIZE)
 def version2number(s): # type: (str) -> int
     """
     Translates a legible NIF version number to the packed-byte numeric representation.
     For example, "10.0.1.0" is translated to 0x0A000100.
+    The letter suffix of KFM versions is ignored.
+    The results are memoized, see also Schema.version_number().
+
+    >>> '0x%08X' % version2number('10.0.1.0')
+    '0x0A000100'
+    >>> '0x%08X' % version2number('1.2.4b')
+    '0x01020400'
     """
     if not s:
         return None
-    l = s.split('.')
+    l = s.rstrip(string.ascii_letters).split('.')
     if len(l) > 4:
         assert False
         return int(s)
@@ -175,6 +233,51 @@ def version2number(s): # type: (str) -> int
             version += int(ver) << ((3-i) * 8)
         return version
 
+def number2version(n): # type: (int) -> str
+    """
+    Translates a packed-byte version number to the four part legible form, the inverse of version2number().
+    See also Schema.version_string(), which keeps the spelling of the <version> tags.
+
+    >>> number2version(0x0A000100)
+    '10.0.1.0'
+    """
+    return '%d.%d.%d.%d' % (n >> 24, (n >> 16) & 0xFF, (n >> 8) & 0xFF, n & 0xFF)
+
+def versions2numbers(versions): # type: (Iterable[str]) -> numpy.ndarray
+    """
+    Translates an array of legible version numbers at once, converting each distinct version only once.
+    Empty versions become 0.  Requires NumPy.
+    @param versions: The version strings.
+    @type versions: array_like
+    @return: The packed version numbers, in the shape of versions.
+    @rtype: numpy.ndarray
+
+    For example:
+        versions2numbers(['20.2.0.7', '4.0.0.2', '20.2.0.7']) == array([0x14020007, 0x04000002, 0x14020007])
+    """
+    import numpy
+
+    versions = numpy.asarray(versions, dtype=str)
+    unique, inverse = numpy.unique(versions, return_inverse=True)
+    numbers = numpy.array([version2number(ver) or 0 for ver in unique], dtype=numpy.uint32)
+    return numbers[inverse].reshape(versions.shape)
+
+def numbers2versions(numbers): # type: (Iterable[int]) -> numpy.ndarray
+    """
+    Translates an array of packed version numbers to legible four part versions, see versions2numbers().
+    Requires NumPy.
+    @param numbers: The packed version numbers.
+    @type numbers: array_like
+    @return: The version strings, in the shape of numbers.
+    @rtype: numpy.ndarray
+    """
+    import numpy
+
+    numbers = numpy.asarray(numbers, dtype=numpy.uint32)
+    unique, inverse = numpy.unique(numbers, return_inverse=True)
+    versions = numpy.array([number2version(int(num)) for num in unique], dtype=str)
+    return versions[inverse].reshape(numbers.shape)
+
 def scanBrackets(expr_str, fromIndex=0): # type: (str, int) -> Tuple[int, int]
     """Looks for matching brackets.
 
@@ -186,7 +289,7 @@ def scanBrackets(expr_str, fromIndex=0): # type: (str, int) -> Tuple[int, int]
     (0, 9)
     >>> s = '  (abc(dd efy 442))xxg'
     >>> startpos, endpos = scanBrackets(s)
-    >>> print s[startpos+1:endpos]
+    >>> print(s[startpos+1:endpos])
     abc(dd efy 442)
     """
     startpos = -1
@@ -208,6 +311,108 @@ def scanBrackets(expr_str, fromIndex=0): # type: (str, int) -> Tuple[int, int]
             raise ValueError("expression syntax error (non-matching brackets?)")
     return (startpos, endpos)
 
+# Tokens of expressions: an operator, a bracket or not, or a terminal running up to the next of these
+EXPRESSION_OPERATOR, EXPRESSION_PUNCTUATION, EXPRESSION_TERMINAL = 1, 2, 3
+EXPRESSION_TOKENS = re.compile(r'\s*(?:(==|!=|>=|<=|&&|\|\||[&|+\-></*])|([()!])'
+                               r'|((?:[^\s&|+\-></*()=!]|=(?!=))(?:[^&|+\-></*()=!]|=(?!=))*))')
+
+class _ExpressionParser:
+    """
+    Parses the text of an Expression by precedence climbing, in a single pass over its tokens.
+
+    >>> _ExpressionParser('(a | b)!=(b&c)', None).parse()[1]
+    '!='
+    >>> str(_ExpressionParser('Num Vertices > 0 && Has Normals', None).parse()[0])
+    'Num Vertices > 0'
+    >>> left, op, right = _ExpressionParser('a - b - c * d', None).parse()
+    >>> str(left), op, str(right)
+    ('a - b', '-', 'c * d')
+    >>> left, op, right = _ExpressionParser('!a || b && c || d', None).parse()
+    >>> str(left), op, str(right)
+    ('!a', '||', 'b && c || d')
+    >>> _ExpressionParser('(a) b', None).parse()
+    Traceback (most recent call last):
+        ...
+    ValueError: expression syntax error: expected operator at 'b'
+    """
+    __slots__ = ('text', 'name_filter', 'tokens', 'pos', 'end')
+
+    def __init__(self, text, name_filter): # type: (str, Callable[[str], str]) -> None
+        self.text = text
+        self.name_filter = name_filter
+        # the kind, text, start and end of each token
+        self.tokens = [] # type: List[Tuple[int, str, int, int]]
+        for match in EXPRESSION_TOKENS.finditer(text):
+            kind = match.lastindex
+            if kind is None:
+                break
+            value = match.group(kind).rstrip()
+            start = match.start(kind)
+            self.tokens.append((kind, value, start, start + len(value)))
+        self.pos = 0
+        self.end = 0
+
+    def parse(self): # type: () -> Tuple[Union[str, Expression], str, Union[str, Expression]]
+        """Returns the left hand side, operator and right hand side of the whole expression."""
+        tree = self.binary(0)
+        if self.pos < len(self.tokens):
+            raise ValueError("expression syntax error (non-matching brackets?)")
+        if isinstance(tree, Expression):
+            return tree.lhs, tree.op, tree.rhs
+        return tree, '', ''
+
+    def binary(self, min_power): # type: (int) -> Union[str, Expression]
+        """Parses operands joined by operators which bind at least as tightly as min_power."""
+        start = self.tokens[self.pos][2] if self.pos < len(self.tokens) else len(self.text)
+        left = self.operand()
+        while self.pos < len(self.tokens):
+            kind, op, op_start, _ = self.tokens[self.pos]
+            if kind != EXPRESSION_OPERATOR:
+                if op == ')':
+                    break
+                raise ValueError("expression syntax error: expected operator at '%s'" % self.text[op_start:])
+            power = Expression.binding_power[op]
+            if power < min_power:
+                break
+            self.pos += 1
+            right = self.binary(power if op in Expression.right_associative else power + 1)
+            left = self.node(start, left, op, right)
+        return left
+
+    def operand(self): # type: () -> Union[str, Expression]
+        """Parses a terminal, a bracketed expression or a negation; an operand may also be left out."""
+        if self.pos == len(self.tokens):
+            return ''
+        kind, value, start, end = self.tokens[self.pos]
+        if kind == EXPRESSION_TERMINAL:
+            self.pos += 1
+            self.end = end
+            return Expression._literal(value, self.name_filter)
+        if value == '(':
+            self.pos += 1
+            inner = self.binary(0)
+            if self.pos == len(self.tokens) or self.tokens[self.pos][1] != ')':
+                raise ValueError("expression syntax error (non-matching brackets?)")
+            self.end = self.tokens[self.pos][3]
+            self.pos += 1
+            return inner
+        if value == '!':
+            self.pos += 1
+            self.end = end
+            return self.node(start, self.operand(), '!', '')
+        return ''
+
+    def node(self, start, left, op, right): # type: (int, Any, str, Any) -> Expression
+        """Returns the sub-expression for the text from start up to the last token parsed."""
+        expr = object.__new__(Expression)
+        expr._init(self.text[start:self.end], left, op, right)
+        return expr
+
+@lru_cache(maxsize=None)
+def _intern_expression(cls, expr_str, name_filter):
+    """Shared instances for Expression.parse"""
+    return cls(expr_str, name_filter)
+
 class Expression:
     """This class represents an expression.
 
@@ -235,67 +440,396 @@ class Expression:
     True
     >>> bool(Expression('1 != 1').eval())
     False
+
+    Operators take the precedence they have in C.
+
+    >>> Expression('1 + 2 * 3').eval()
+    7
+    >>> Expression('x || 1 == 2 && !y').code()
+    '(x || ((1 == 2) && (!y)))'
+
+    Expressions are immutable, because parse() shares them between all users of the same string.
+
+    >>> Expression('x').lhs = 'y'
+    Traceback (most recent call last):
+        ...
+    AttributeError: Expression is immutable, use with_lhs() for a modified copy
     """
-    operators = ['==', '!=', '>=', '<=', '&&', '||', '&', '|', '-', '+', '>', '<', '/', '*']
+    # No instance __dict__, _compiled and _names stay unset until compile() and get_names() are called
+    __slots__ = ('_code', '_left', '_op', '_right', '_compiled', '_names')
+
+    # How tightly each operator binds its operands, as in C.
+    # The associative logical and bitwise operators group to the right, as they always have here,
+    # so that the brackets in the generated code stay the same.
+    binding_power = {'*': 7, '/': 7, '+': 6, '-': 6, '>=': 5, '<=': 5, '>': 5, '<': 5, '==': 4, '!=': 4,
+                     '&': 3, '|': 2, '&&': 1, '||': 0}
+    right_associative = frozenset(('&', '|', '&&', '||'))
+    # literals _parse() converts to integers, compiled once
+    version_literal = re.compile("[0-9]+\\.[0-9]+\\.[0-9]+\\.[0-9]+")
+    integer_literal = re.compile("[0-9]+")
     def __init__(self, expr_str, name_filter=None):
-        self._code = expr_str
-        left, self._op, right = self._partition(expr_str)
-        self._left = self._parse(left, name_filter)
-        if right:
-            self._right = self._parse(right, name_filter)
-        else:
-            self._right = ''
+        with _phase('expressions'):
+            left, op, right = _ExpressionParser(expr_str, name_filter).parse()
+        _count('expressions', 1)
+        self._init(expr_str, left, op, right)
+
+    def _init(self, code, left, op, right):
+        """Sets the slots, bypassing the immutability of __setattr__."""
+        object.__setattr__(self, '_code', code)
+        object.__setattr__(self, '_left', left)
+        object.__setattr__(self, '_op', op)
+        object.__setattr__(self, '_right', right)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Expression is immutable, use with_lhs() for a modified copy")
+
+    @classmethod
+    def parse(cls, expr_str, name_filter=None): # type: (str, Callable[[str], str]) -> Expression
+        """Returns the shared expression for expr_str, parsing it only the first time.
+
+        >>> Expr.parse('Has Normals') is Expr.parse('Has Normals')
+        True
+        >>> Expr.parse('Has Normals') is Expression.parse('Has Normals')
+        False
+        """
+        return _intern_expression(cls, expr_str, name_filter)
+
+    @staticmethod
+    def cache_info():
+        """Returns the hits, misses and size of the parse() cache."""
+        return _intern_expression.cache_info()
+
+    def with_lhs(self, lhs): # type: (Union[str, Expression]) -> Expression
+        """Returns a copy of the expression with a different left hand side.
+
+        >>> str(Expression('ARG == 2').with_lhs('Interpolation'))
+        'Interpolation == 2'
+        """
+        copy = object.__new__(type(self))
+        copy._init(self._code, lhs, self._op, self._right)
+        return copy
 
     def eval(self, data=None):
         """Evaluate the expression to an integer."""
 
         if isinstance(self._left, Expression):
             left = self._left.eval(data)
-        elif isinstance(self._left, str):
-            left = getattr(data, self._left) if self._left != '""' else ""
         else:
-            assert isinstance(self._left, int) # debug
-            left = self._left
+            left = self._terminal(self._left, data)
 
         if not self._op:
             return left
+        if self._op == '!':
+            return not left
+        # short-circuit like the generated C++ does
+        if self._op == '&&':
+            return int(bool(left and self._eval_rhs(data)))
+        if self._op == '||':
+            return int(bool(left or self._eval_rhs(data)))
 
-        if isinstance(self._right, Expression):
-            right = self._right.eval(data)
-        elif isinstance(self._right, str):
-            right = getattr(data, self._right) if self._right != '""' else ""
-        else:
-            assert isinstance(self._right, int) # debug
-            right = self._right
+        return self._operate(self._op, left, self._eval_rhs(data))
 
-        if self._op == '==':
+    @staticmethod
+    def _operate(op, left, right):
+        """Apply a binary operator to the values of both sides."""
+        if op == '&&':
+            return int(bool(left and right))
+        elif op == '||':
+            return int(bool(left or right))
+        elif op == '==':
             return int(left == right)
-        elif self._op == '!=':
+        elif op == '!=':
             return int(left != right)
-        elif self._op == '>=':
+        elif op == '>=':
             return int(left >= right)
-        elif self._op == '<=':
+        elif op == '<=':
             return int(left <= right)
-        elif self._op == '&&':
-            return int(left and right)
-        elif self._op == '||':
-            return int(left or right)
-        elif self._op == '&':
+        elif op == '>':
+            return int(left > right)
+        elif op == '<':
+            return int(left < right)
+        elif op == '&':
             return left & right
-        elif self._op == '|':
+        elif op == '|':
             return left | right
-        elif self._op == '-':
+        elif op == '-':
             return left - right
-        elif self._op == '+':
+        elif op == '+':
             return left + right
-        elif self._op == '/':
+        elif op == '/':
             return left / right
-        elif self._op == '*':
+        elif op == '*':
             return left * right
-        elif self._op == '!':
-            return not left
         else:
+            raise NotImplementedError("expression syntax error: operator '" + op + "' not implemented")
+
+    def _eval_rhs(self, data):
+        """Evaluate the right hand side."""
+        if isinstance(self._right, Expression):
+            return self._right.eval(data)
+        return self._terminal(self._right, data)
+
+    @staticmethod
+    def _terminal(term, data):
+        """Evaluate a terminal: an int, an integer literal, an empty string literal, or an attribute of data."""
+        if isinstance(term, int):
+            return term
+        if term == '""':
+            return ""
+        if term.isdigit():
+            return int(term)
+        if term.startswith('0x'):
+            return int(term, 16)
+        return getattr(data, term)
+
+    def simplify(self, env=None, condition=False): # type: (Optional[Mapping[str, int]], bool) -> Expression
+        """
+        Returns the expression with its constant parts folded, or the expression itself if nothing folds.
+        @param env: The known values of terminal names, for example the version of the file.
+        @type env: Mapping[str, int]
+        @param condition: Whether only the truth value of the expression matters, as for a cond or vercond.
+            Operands of && and || which cannot change the outcome are then dropped, as are double negations,
+            so 'x && 1' simplifies to 'x'.
+        @type condition: bool
+
+        >>> Expression('(Version >= 0x14000004) && (Num Vertices > 2 * 3)').simplify({'Version': 0x14020007}, True).code()
+        '(Num Vertices > 6)'
+        >>> Expression('!!(1 == 1) || Has Normals').simplify().code()
+        '1'
+        >>> Expression('!!Has Normals').simplify(condition=True).code()
+        'Has Normals'
+        >>> Expression('(Has Normals && 1) + 1').simplify().code()
+        '((Has Normals && 1) + 1)'
+        >>> e = Expression('(x & 3) == 2')
+        >>> e.simplify() is e
+        True
+        """
+        tree = self._simplify(env or {}, condition)
+        if tree is self:
+            return self
+        expr = object.__new__(type(self))
+        if isinstance(tree, Expression):
+            expr._init(tree._code, tree._left, tree._op, tree._right)
+        else:
+            expr._init(tree, tree, '', '')
+        return expr
+
+    def _simplify(self, env, condition):
+        """Returns the expression itself if nothing folds, else the folded expression or terminal, see simplify()."""
+        # the operands of logical operators are only tested for truth
+        logical = self._op in ('!', '&&', '||')
+        left = self._simplify_terminal(self._left, env, logical)
+        if not self._op:
+            return self if left is self._left else left
+        left_value = self._constant(left)
+        if self._op == '!':
+            if left_value is not None:
+                return str(int(not left_value))
+            if condition and isinstance(left, Expression) and left._op == '!':
+                return left._left
+            return self if left is self._left else self._node(left, '!', '')
+        right = self._simplify_terminal(self._right, env, logical)
+        right_value = self._constant(right)
+        if logical:
+            if left_value is not None and right_value is not None:
+                return str(self._operate(self._op, left_value, right_value))
+            # the truth value which decides the outcome on its own
+            decisive = (self._op == '||')
+            for value, other in ((left_value, right), (right_value, left)):
+                if value is not None:
+                    if bool(value) == decisive:
+                        return str(int(decisive))
+                    if condition:
+                        return other
+        elif left_value is not None and right_value is not None:
+            try:
+                value = self._operate(self._op, left_value, right_value)
+            except ArithmeticError:
+                value = None
+            # negative and fractional results have no literal
+            if isinstance(value, int) and value >= 0:
+                return str(value)
+        if left is self._left and right is self._right:
+            return self
+        return self._node(left, self._op, right)
+
+    @staticmethod
+    def _simplify_terminal(term, env, condition):
+        """Simplify a sub-expression, or replace a terminal by its value in env."""
+        if isinstance(term, Expression):
+            return term._simplify(env, condition)
+        value = env.get(term)
+        if isinstance(value, int) and value >= 0:
+            return str(value)
+        return term
+
+    @staticmethod
+    def _constant(term): # type: (Union[str, Expression]) -> Optional[int]
+        """Returns the value of an integer literal, else None."""
+        if isinstance(term, int):
+            return term
+        if isinstance(term, str):
+            try:
+                if term.isdigit():
+                    return int(term)
+                if term.startswith('0x'):
+                    return int(term, 16)
+            except ValueError:
+                pass
+        return None
+
+    @staticmethod
+    def _node(left, op, right): # type: (Union[str, Expression], str, Union[str, Expression]) -> Expression
+        """Returns a new sub-expression."""
+        def source(term):
+            return '(%s)' % term._code if isinstance(term, Expression) else str(term)
+        expr = object.__new__(Expression)
+        if op == '!':
+            expr._init('!' + source(left), left, op, right)
+        else:
+            expr._init('%s %s %s' % (source(left), op, source(right)), left, op, right)
+        return expr
+
+    # Python source for each operator, with the same results as eval()
+    PYTHON_OPERATORS = {
+        '==': 'int(%s == %s)', '!=': 'int(%s != %s)', '>=': 'int(%s >= %s)', '<=': 'int(%s <= %s)',
+        '>': 'int(%s > %s)', '<': 'int(%s < %s)', '&&': 'int(bool(%s and %s))', '||': 'int(bool(%s or %s))',
+        '&': '(%s & %s)', '|': '(%s | %s)', '-': '(%s - %s)', '+': '(%s + %s)', '/': '(%s / %s)', '*': '(%s * %s)',
+    }
+
+    def python(self): # type: () -> str
+        """Format the expression as Python source evaluating it on an object named data.
+
+        >>> Expression('(Num Vertices > 0) && Has Normals').python()
+        "int(bool(int(getattr(data, 'Num Vertices') > 0) and getattr(data, 'Has Normals')))"
+        """
+        left = self._python_terminal(self._left)
+        if not self._op:
+            return left
+        if self._op == '!':
+            return '(not %s)' % left
+        if self._op not in self.PYTHON_OPERATORS:
             raise NotImplementedError("expression syntax error: operator '" + self._op + "' not implemented")
+        return self.PYTHON_OPERATORS[self._op] % (left, self._python_terminal(self._right))
+
+    @staticmethod
+    def _python_terminal(term):
+        """Format a terminal as Python source, see _terminal()."""
+        if isinstance(term, Expression):
+            return term.python()
+        if isinstance(term, int):
+            return repr(term)
+        if term == '""':
+            return "''"
+        if term.isdigit():
+            return str(int(term))
+        if term.startswith('0x'):
+            return str(int(term, 16))
+        return 'getattr(data, %r)' % term
+
+    def compile(self): # type: () -> Callable[[Any], Any]
+        """Returns a function of data with the same result as eval(data), compiled once per expression.
+
+        >>> class A(object):
+        ...     x = 6
+        >>> Expression('(x & 3) == 2').compile()(A())
+        1
+        >>> Expression('(x & 3) == 2').compile() is Expression('(x & 3) == 2').compile()
+        False
+        >>> Expression.parse('x').compile() is Expression.parse('x').compile()
+        True
+        """
+        try:
+            return self._compiled
+        except AttributeError:
+            pass
+        code = compile('lambda data=None: ' + self.python(), '<expression %s>' % self._code, 'eval')
+        func = eval(code, {'__builtins__': {'bool': bool, 'getattr': getattr, 'int': int}})
+        # memoized on the instance, which is otherwise immutable
+        object.__setattr__(self, '_compiled', func)
+        return func
+
+    # NumPy function for each operator, comparisons and logical operators give 0 or 1 like the generated C++
+    NUMPY_OPERATORS = {
+        '==': 'equal', '!=': 'not_equal', '>=': 'greater_equal', '<=': 'less_equal', '>': 'greater', '<': 'less',
+        '&&': 'logical_and', '||': 'logical_or', '&': 'bitwise_and', '|': 'bitwise_or', '-': 'subtract',
+        '+': 'add', '/': 'true_divide', '*': 'multiply',
+    }
+
+    def eval_batch(self, columns): # type: (Mapping[str, Any]) -> numpy.ndarray
+        """
+        Evaluate the expression for many records at once with vectorized NumPy operators.
+        Requires NumPy.
+        @param columns: An array of values for each terminal name in get_names(), one element per record.
+        @type columns: Mapping[str, array_like]
+        @return: The result for each record, broadcast to the shape of the columns.
+        @rtype: numpy.ndarray
+
+        For example:
+            Expression('(Num Vertices > 0) && Has Normals').eval_batch(
+                {'Num Vertices': [0, 3, 5], 'Has Normals': [1, 1, 0]}) == array([0, 1, 0])
+        """
+        import numpy
+
+        arrays = {}
+        for name in self.get_names():
+            if name not in columns:
+                raise KeyError("no column for '%s' in expression '%s'" % (name, self._code))
+            arrays[name] = numpy.asarray(columns[name])
+        result = numpy.asarray(self._eval_batch(numpy, arrays))
+        shape = numpy.broadcast_shapes(*(numpy.shape(column) for column in columns.values()))
+        if result.shape != shape:
+            result = numpy.broadcast_to(result, shape).copy()
+        return result
+
+    def _eval_batch(self, numpy, arrays):
+        """Evaluate the expression on arrays, see eval_batch()."""
+        left = self._batch_terminal(self._left, numpy, arrays)
+        if not self._op:
+            return left
+        if self._op == '!':
+            return numpy.logical_not(left).astype(int)
+        if self._op not in self.NUMPY_OPERATORS:
+            raise NotImplementedError("expression syntax error: operator '" + self._op + "' not implemented")
+        right = self._batch_terminal(self._right, numpy, arrays)
+        result = getattr(numpy, self.NUMPY_OPERATORS[self._op])(left, right)
+        if result.dtype == bool:
+            result = result.astype(int)
+        return result
+
+    @staticmethod
+    def _batch_terminal(term, numpy, arrays):
+        """Evaluate a terminal on arrays, see _terminal()."""
+        if isinstance(term, Expression):
+            return term._eval_batch(numpy, arrays)
+        if isinstance(term, str) and term in arrays:
+            return arrays[term]
+        return numpy.asarray(Expression._terminal(term, None))
+
+    def get_names(self):
+        """Return the distinct terminal names which are read from the data, in order of appearance.
+
+        >>> Expression('(Flags & 0x04) || (Num Vertices == Num Normals)').get_names()
+        ['Flags', 'Num Vertices', 'Num Normals']
+        """
+        try:
+            return list(self._names)
+        except AttributeError:
+            pass
+        names = []
+        for term in self.get_terminals():
+            if term not in names and not term.isdigit() and not term.startswith('0x') and term != '""':
+                names.append(term)
+        # memoized on the instance, which is otherwise immutable
+        object.__setattr__(self, '_names', tuple(names))
+        return names
+
+    def __getstate__(self):
+        """Pickle without the compiled function and the memoized names."""
+        return (self._code, self._left, self._op, self._right)
+
+    def __setstate__(self, state):
+        self._init(*state)
 
     def __str__(self): # type: () -> str
         """Reconstruct the expression to a string."""
@@ -303,6 +837,8 @@ class Expression:
         left = str(self._left)
         if not self._op:
             return left
+        if self._op == '!':
+            return '!' + left
         right = str(self._right)
         return left + ' ' + self._op + ' ' + right
 
@@ -314,139 +850,18 @@ class Expression:
         return self.__str__().encode(encoding)
 
     @classmethod
-    def _parse(cls, expr_str, name_filter=None): # type: (str, Callable[[str], str]) -> str
-        """Returns an Expression, string, or int, depending on the
-        contents of <expr_str>."""
-        # brackets or operators => expression
-        if ("(" in expr_str) or (")" in expr_str):
-            return Expression(expr_str, name_filter)
-        for op in cls.operators:
-            if expr_str.find(op) != -1:
-                return Expression(expr_str, name_filter)
-
-        mver = re.compile("[0-9]+\\.[0-9]+\\.[0-9]+\\.[0-9]+")
-        iver = re.compile("[0-9]+")
+    def _literal(cls, expr_str, name_filter=None): # type: (str, Callable[[str], str]) -> str
+        """Returns the terminal for the text of an operand: an integer literal, or a name."""
         # try to convert it to an integer
         try:
-            if mver.match(expr_str):
+            if cls.version_literal.match(expr_str):
                 return "0x%08X"%(version2number(expr_str))
-            elif iver.match(expr_str):
+            elif cls.integer_literal.match(expr_str):
                 return str(int(expr_str))
         except ValueError:
             pass
         # failed, so return the string, passed through the name filter
-        return name_filter(expr_str) if name_filter else expr_str
-
-    @classmethod
-    def _partition(cls, expr_str):
-        """Partitions expr_str. See examples below.
-
-        >>> Expression._partition('abc || efg')
-        ('abc', '||', 'efg')
-        >>> Expression._partition('abc||efg')
-        ('abc', '||', 'efg')
-        >>> Expression._partition('abcdefg')
-        ('abcdefg', '', '')
-        >>> Expression._partition(' abcdefg ')
-        ('abcdefg', '', '')
-        >>> Expression._partition(' (a | b) & c ')
-        ('a | b', '&', 'c')
-        >>> Expression._partition('(a | b)!=(b&c)')
-        ('a | b', '!=', 'b&c')
-        >>> Expression._partition('(a== b) &&(( b!=c)||d )')
-        ('a== b', '&&', '( b!=c)||d')
-        """
-        # check for unary operators
-        if expr_str.strip().startswith('!'):
-            return expr_str.lstrip(' !'), '!', None
-        lenstr = len(expr_str)
-        # check if the left hand side starts with brackets
-        # and if so, find the position of the starting bracket and the ending
-        # bracket
-        left_startpos, left_endpos = cls._scanBrackets(expr_str)
-        if left_startpos >= 0:
-            # yes, it is a bracketted expression
-            # so remove brackets and whitespace,
-            # and let that be the left hand side
-            left_str = expr_str[left_startpos+1:left_endpos].strip()
-
-            # the next token should be the operator
-            # find the position where the operator should start
-            op_startpos = left_endpos+1
-            while op_startpos < lenstr and expr_str[op_startpos] == " ":
-                op_startpos += 1
-            if op_startpos < lenstr:
-                # to avoid confusion between && and &, and || and |,
-                # let's first scan for operators of two characters
-                # and then for operators of one character
-                for op_endpos in range(op_startpos+1, op_startpos-1, -1):
-                    op_str = expr_str[op_startpos:op_endpos+1]
-                    if op_str in cls.operators:
-                        break
-                else:
-                    raise ValueError("expression syntax error: expected operator at '%s'"%expr_str[op_startpos:])
-            else:
-                return cls._partition(left_str)
-        else:
-            # it's not... so we need to scan for the first operator
-            for op_startpos, ch in enumerate(expr_str):
-                if ch == ' ':
-                    continue
-                if ch == '(' or ch == ')':
-                    raise ValueError("expression syntax error: expected operator before '%s'"%expr_str[op_startpos:])
-                # to avoid confusion between && and &, and || and |,
-                # let's first scan for operators of two characters
-                for op_endpos in range(op_startpos+1, op_startpos-1, -1):
-                    op_str = expr_str[op_startpos:op_endpos+1]
-                    if op_str in cls.operators:
-                        break
-                else:
-                    continue
-                break
-            else:
-                # no operator found, so we are done
-                left_str = expr_str.strip()
-                op_str = ''
-                right_str = ''
-                return left_str, op_str, right_str
-            # operator found! now get the left hand side
-            left_str = expr_str[:op_startpos].strip()
-
-        return left_str, op_str, expr_str[op_endpos+1:].strip()
-
-    @staticmethod
-    def _scanBrackets(expr_str, fromIndex=0):
-        """Looks for matching brackets.
-
-        >>> Expression._scanBrackets('abcde')
-        (-1, -1)
-        >>> Expression._scanBrackets('()')
-        (0, 1)
-        >>> Expression._scanBrackets('(abc(def))g')
-        (0, 9)
-        >>> s = '  (abc(dd efy 442))xxg'
-        >>> startpos, endpos = Expression._scanBrackets(s)
-        >>> print s[startpos+1:endpos]
-        abc(dd efy 442)
-        """
-        startpos = -1
-        endpos = -1
-        scandepth = 0
-        for scanpos in range(fromIndex, len(expr_str)):
-            scanchar = expr_str[scanpos]
-            if scanchar == "(":
-                if startpos == -1:
-                    startpos = scanpos
-                scandepth += 1
-            elif scanchar == ")":
-                scandepth -= 1
-                if scandepth == 0:
-                    endpos = scanpos
-                    break
-        else:
-            if startpos != -1 or endpos != -1:
-                raise ValueError("expression syntax error (non-matching brackets?)")
-        return (startpos, endpos)
+        return sys.intern(name_filter(expr_str) if name_filter else expr_str)
 
     def code(self, prefix='', brackets=True, name_filter=None): # type: (str, bool, Callable[[str], str]) -> str
         """Format an expression as a string."""
@@ -457,6 +872,8 @@ class Expression:
                 return ''
             if isinstance(self.lhs, int):
                 return self.lhs
+            elif self.lhs.isdigit() or self.lhs.startswith('0x'):
+                return self.lhs
             elif self.lhs in TYPES_BLOCK:
                 return 'IsDerivedType(%s::TYPE)' % self.lhs
             else:
@@ -498,14 +915,20 @@ class Expression:
         elif self.rhs:
             yield self.rhs
 
-    def __getattr__(self, name):
-        if name == 'lhs':
-            return getattr(self, '_left')
-        if name == 'rhs':
-            return getattr(self, '_right')
-        if name == 'op':
-            return getattr(self, '_op')
-        return object.__getattribute__(self, name)
+    @property
+    def lhs(self): # type: () -> Union[str, Expression]
+        """The left hand side, a terminal name or a sub-expression."""
+        return self._left
+
+    @property
+    def rhs(self): # type: () -> Union[str, Expression]
+        """The right hand side, empty if there is no operator."""
+        return self._right
+
+    @property
+    def op(self): # type: () -> str
+        """The operator, empty for a single terminal."""
+        return self._op
 
     def isdigit(self):
         """ducktyping: pretend we're also a string with isdigit() method"""
@@ -523,6 +946,8 @@ class Expr(Expression):
     @ivar rhs: The right hand side of the expression?
     @type rhs: string
     """
+    __slots__ = ()
+
     def __init__(self, n, name_filter=None):
         """
         This constructor takes the expression in the form of a string and tokenizes it into left-hand side,
@@ -544,27 +969,27 @@ class Option:
     @ivar name: The name of this member variable.  Comes from the "name" attribute of the <option> tag.
     @ivar description: The description of this option.  Comes from the text between <option> and </option>.
     @ivar cname: The name of this member for use in C++.
+    @ivar bit: The bit position of a <bitflags> option, unset for <enum> options.
     """
+    __slots__ = ('value', 'name', 'description', 'cname', 'bit')
+
     def __init__(self, element):
         """
         This constructor converts an XML <option> element into an Option object.
         """
-        assert element.tagName == 'option'
-        parent = element.parentNode
-        #sisters = parent.getElementsByTagName('option')
+        assert element.tag == 'option'
 
         # member attributes
-        self.value = element.getAttribute('value') # type: str
-        self.name = element.getAttribute('name') # type: str
+        self.value = element.get('value', '') # type: str
+        self.name = element.get('name', '') # type: str
         self.description = self.name # type: str
-        if element.firstChild:
-            assert element.firstChild.nodeType == Node.TEXT_NODE
-            self.description = element.firstChild.nodeValue.strip()
+        if element.text is not None:
+            self.description = element.text.strip()
         self.cname = self.name.upper().replace(" ", "_").replace("-", "_").replace("/", "_").replace("=", "_").replace(":", "_") # type: str
 
 class Member:
     """
-    This class represents the nif.xml <field> tag.
+    This class represents the nif.xml <field> tag, or <add> in kfm.xml.
     @ivar name:  The name of this member variable.  Comes from the "name" attribute of the <field> tag.
     @ivar arg: The argument of this member variable.  Comes from the "arg" attribute of the <field> tag.
     @ivar template: The template type of this member variable.  Comes from the "template" attribute of the <field> tag.
@@ -596,53 +1021,62 @@ class Member:
     @ivar carr1_ref: Unlike default, arr1_ref isn't formatted for C++ so use this instead?
     @ivar carr2_ref: Unlike default, arr2_ref isn't formatted for C++ so use this instead?
     @ivar ccond_ref: Unlike default, cond_ref isn't formatted for C++ so use this instead?
+    @ivar type_obj: The type of the member, once all types are loaded, see Schema.resolve_types().
+        None if the type is TEMPLATE or unknown.
     @ivar next_dup: Next duplicate member
     @ivar is_manual_update: True if the member value is manually updated by the code
     """
-    def __init__(self, element):
+    # No instance __dict__, there is one Member per <field> of every compound and block
+    __slots__ = ('name', 'suffix', 'type', 'type_obj', 'arg', 'template', 'arr1', 'arr2', 'cond', 'func',
+                 'default', 'orig_ver1', 'orig_ver2', 'ver1', 'ver2', 'userver', 'userver2', 'vercond',
+                 'is_public', 'is_abstract', 'next_dup', 'is_manual_update', 'is_calculated', 'description',
+                 'uses_argument', 'type_is_native', 'is_duplicate', 'arr2_dynamic',
+                 'arr1_ref', 'arr2_ref', 'cond_ref', 'cname', 'ctype', 'carg', 'ctemplate',
+                 'carr1_ref', 'carr2_ref', 'ccond_ref')
+
+    def __init__(self, element, schema):
         """
         This constructor converts an XML <field> element into a Member object.
         Some sort of processing is applied to the various variables that are copied from the XML tag...
         Seems to be trying to set reasonable defaults for certain types, and put things into C++ format generally.
-        @param prefix: An optional prefix used in some situations?
-        @type prefix: string
-        @return The expression formatted into a string?
-        @rtype: string?
+        The attributes which depend on sibling fields are filled in afterwards by analyze_siblings.
+        @param element: The <field> or <add> element.
+        @type element: xml.etree.ElementTree.Element
+        @param schema: The schema being loaded, with the types declared before this field.
+        @type schema: Schema
         """
-        assert element.tagName == 'field'
-        parent = element.parentNode
-        sisters = parent.getElementsByTagName('field')
-
-        # member attributes
-        self.name      = element.getAttribute('name') # type: str
-        self.suffix    = element.getAttribute('suffix') # type: str
-        self.type      = element.getAttribute('type') # type: str
-        self.arg       = element.getAttribute('arg') # type: str
-        self.template  = element.getAttribute('template') # type: str
-        self.arr1      = Expr(element.getAttribute('arr1')) # type: Expr
-        self.arr2      = Expr(element.getAttribute('arr2')) # type: Expr
-        self.cond      = Expr(element.getAttribute('cond')) # type: Expr
-        self.func      = element.getAttribute('function') # type: str
-        self.default   = element.getAttribute('default') # type: str
-        self.orig_ver1 = element.getAttribute('ver1') # type: str
-        self.orig_ver2 = element.getAttribute('ver2') # type: str
-        self.ver1      = version2number(element.getAttribute('ver1')) # type: int
-        self.ver2      = version2number(element.getAttribute('ver2')) # type: int
+        assert element.tag in FIELD_TAGS
+
+        # member attributes, the names interned as they repeat across the schema
+        self.name      = sys.intern(element.get('name', '')) # type: str
+        self.suffix    = element.get('suffix', '') # type: str
+        self.type      = sys.intern(element.get('type', '')) # type: str
+        self.type_obj  = None # type: Optional[Basic]
+        self.arg       = sys.intern(element.get('arg', '')) # type: str
+        self.template  = sys.intern(element.get('template', '')) # type: str
+        self.arr1      = Expr.parse(element.get('arr1', '')) # type: Expr
+        self.arr2      = Expr.parse(element.get('arr2', '')) # type: Expr
+        self.cond      = Expr.parse(element.get('cond', '')) # type: Expr
+        self.func      = element.get('function', '') # type: str
+        self.default   = element.get('default', '') # type: str
+        self.orig_ver1 = element.get('ver1', '') # type: str
+        self.orig_ver2 = element.get('ver2', '') # type: str
+        self.ver1      = version2number(self.orig_ver1) # type: int
+        self.ver2      = version2number(self.orig_ver2) # type: int
         xint = lambda s: int(s) if s else None
-        self.userver   = xint(element.getAttribute('userver')) # type: Optional[int]
-        self.userver2  = xint(element.getAttribute('userver2')) # type: Optional[int]
-        self.vercond   = Expr(element.getAttribute('vercond')) # type: Expr
-        self.is_public = (element.getAttribute('public') == "1") # type: bool
-        self.is_abstract = (element.getAttribute('abstract') == "1") # type: bool
+        self.userver   = xint(element.get('userver')) # type: Optional[int]
+        self.userver2  = xint(element.get('userver2')) # type: Optional[int]
+        self.vercond   = Expr.parse(element.get('vercond', '')) # type: Expr
+        self.is_public = (element.get('public') == "1") # type: bool
+        self.is_abstract = (element.get('abstract') == "1") # type: bool
         self.next_dup  = None # type: Optional[Member]
         self.is_manual_update = False # type: bool
-        self.is_calculated = (element.getAttribute('calculated') == "1") # type: bool
+        self.is_calculated = (element.get('calculated') == "1") # type: bool
 
         # Get description from text between start and end tags
         self.description = "" # type: str
-        if element.firstChild:
-            assert element.firstChild.nodeType == Node.TEXT_NODE
-            self.description = element.firstChild.nodeValue.strip()
+        if element.text is not None:
+            self.description = element.text.strip()
         elif self.name.lower().find("unk") == 0:
             self.description = "Unknown."
 
@@ -662,16 +1096,16 @@ class Member:
                 pass
             elif self.type == "StringOffset":
                 self.default = "-1"
-            elif self.type in NAMES_BASIC:
+            elif self.type in schema.types_basic:
                 self.default = "0"
-            elif self.type in NAMES_FLAG or self.type in NAMES_ENUM:
+            elif self.type in schema.types_flag or self.type in schema.types_enum:
                 self.default = "0"
         if self.default:
             if self.default[0] == '(' and self.default[-1] == ')':
                 self.default = self.default[1:-1]
             if self.arr1.lhs: # handle static array types
                 if self.arr1.lhs.isdigit():
-                    sep = (',(%s)'%class_name(self.type))
+                    sep = (',(%s)'%class_name(self.type, schema.types_native))
                     self.default = self.arr1.lhs + sep + sep.join(self.default.split(' ', int(self.arr1.lhs)))
             elif self.type == "string" or self.type == "IndexString" or self.type == "SizedString":
                 self.default = "\"" + self.default + "\""
@@ -683,29 +1117,18 @@ class Member:
             elif self.default.find(',') != -1:
                 pass
             else:
-                self.default = "(%s)%s"%(class_name(self.type), self.default)
+                self.default = "(%s)%s"%(class_name(self.type, schema.types_native), self.default)
 
         # calculate other stuff
         self.uses_argument = (self.cond.lhs == '(ARG)' or self.arr1.lhs == '(ARG)' or self.arr2.lhs == '(ARG)') # type: bool
         # true if the type is implemented natively
-        self.type_is_native = self.name in TYPES_NATIVE # type: bool
+        self.type_is_native = self.name in schema.types_native # type: bool
 
         # calculate stuff from reference to previous members
         # true if this is a duplicate of a previously declared member
         self.is_duplicate = False # type: bool
         # true if arr2 refers to an array
         self.arr2_dynamic = False # type: bool
-        sis = element.previousSibling
-        while sis:
-            if sis.nodeType == Node.ELEMENT_NODE:
-                sis_name = sis.getAttribute('name')
-                if sis_name == self.name and not self.suffix:
-                    self.is_duplicate = True
-                sis_arr1 = Expr(sis.getAttribute('arr1'))
-                sis_arr2 = Expr(sis.getAttribute('arr2'))
-                if sis_name == self.arr2.lhs and sis_arr1.lhs:
-                    self.arr2_dynamic = True
-            sis = sis.previousSibling
 
         # Calculate stuff from reference to next members
         # Names of the attributes it is a (unmasked) size of
@@ -714,52 +1137,86 @@ class Member:
         self.arr2_ref = [] # type: List[str]
         # Names of the attributes it is a condition of
         self.cond_ref = [] # type: List[str]
-        sis = element.nextSibling
-        while sis is not None:
-            if sis.nodeType == Node.ELEMENT_NODE:
-                sis_name = sis.getAttribute('name')
-                sis_arr1 = Expr(sis.getAttribute('arr1'))
-                sis_arr2 = Expr(sis.getAttribute('arr2'))
-                sis_cond = Expr(sis.getAttribute('cond'))
-                if sis_arr1.lhs == self.name and (not sis_arr1.rhs or sis_arr1.rhs.isdigit()):
-                    self.arr1_ref.append(sis_name)
-                if sis_arr2.lhs == self.name and (not sis_arr2.rhs or sis_arr2.rhs.isdigit()):
-                    self.arr2_ref.append(sis_name)
-                if sis_cond.lhs == self.name:
-                    self.cond_ref.append(sis_name)
-            sis = sis.nextSibling
 
         # C++ names
         self.cname     = member_name(self.name if not self.suffix else self.name + "_" + self.suffix) # type: str
-        self.ctype     = class_name(self.type) # type: str
+        self.ctype     = class_name(self.type, schema.types_native) # type: str
         self.carg      = member_name(self.arg) # type: str
-        self.ctemplate = class_name(self.template) # type: str
-        self.carr1_ref = [member_name(n) for n in self.arr1_ref] # type: List[str]
-        self.carr2_ref = [member_name(n) for n in self.arr2_ref] # type: List[str]
-        self.ccond_ref = [member_name(n) for n in self.cond_ref] # type: List[str]
+        self.ctemplate = class_name(self.template, schema.types_native) # type: str
+        self.carr1_ref = [] # type: List[str]
+        self.carr2_ref = [] # type: List[str]
+        self.ccond_ref = [] # type: List[str]
+
+def analyze_siblings(fields):
+    """
+    Calculates the Member attributes which refer to previous or next siblings.
+    Each expression is parsed once, and the siblings are visited once forwards
+    and once backwards with lookups by name instead of rescanning all siblings per member.
+    @param fields: Every child element of a tag in document order, with its Member if it is a <field>.
+    @type fields: List[Tuple[xml.etree.ElementTree.Element, Optional[Member]]]
+    """
+    siblings = []
+    for element, mem in fields:
+        if mem:
+            siblings.append((mem.name, mem.arr1, mem.arr2, mem.cond, mem))
+        else:
+            siblings.append((element.get('name', ''), Expr.parse(element.get('arr1', '')),
+                             Expr.parse(element.get('arr2', '')), Expr.parse(element.get('cond', '')), None))
+
+    # previous members: names declared so far, and names declared so far which are arrays
+    names = set()
+    arrays = set()
+    for name, arr1, arr2, cond, mem in siblings:
+        if mem:
+            if name in names and not mem.suffix:
+                mem.is_duplicate = True
+            if arr2.lhs in arrays:
+                mem.arr2_dynamic = True
+        names.add(name)
+        if arr1.lhs:
+            arrays.add(name)
+
+    # next members: names of the later members sized or conditioned by each name, in reverse order
+    arr1_refs = {}
+    arr2_refs = {}
+    cond_refs = {}
+    for name, arr1, arr2, cond, mem in reversed(siblings):
+        if mem:
+            mem.arr1_ref = arr1_refs.get(name, [])[::-1]
+            mem.arr2_ref = arr2_refs.get(name, [])[::-1]
+            mem.cond_ref = cond_refs.get(name, [])[::-1]
+            mem.carr1_ref = [member_name(n) for n in mem.arr1_ref]
+            mem.carr2_ref = [member_name(n) for n in mem.arr2_ref]
+            mem.ccond_ref = [member_name(n) for n in mem.cond_ref]
+        if not arr1.rhs or arr1.rhs.isdigit():
+            arr1_refs.setdefault(arr1.lhs, []).append(name)
+        if not arr2.rhs or arr2.rhs.isdigit():
+            arr2_refs.setdefault(arr2.lhs, []).append(name)
+        cond_refs.setdefault(cond.lhs, []).append(name)
 
 class Version:
     """This class represents the nif.xml <version> tag."""
     def __init__(self, element):
-        self.num = element.getAttribute('num') # type: str
+        self.num = element.get('num', '') # type: str
+        self.number = version2number(self.num) # type: int
         # Treat the version as a name to match other tags
         self.name = self.num # type: str
-        self.description = element.firstChild.nodeValue.strip() # type: str
+        self.description = element.text.strip() # type: str
 
 class Basic:
     """This class represents the nif.xml <basic> tag."""
-    def __init__(self, element, ntypes):
-        self.name = element.getAttribute('name') # type: str
+    def __init__(self, element, schema):
+        self.name = sys.intern(element.get('name', '')) # type: str
         assert self.name # debug
-        self.cname = class_name(self.name) # type: str
+        self.cname = class_name(self.name, schema.types_native) # type: str
         self.description = "" # type: str
-        if element.firstChild and element.firstChild.nodeType == Node.TEXT_NODE:
-            self.description = element.firstChild.nodeValue.strip()
+        if element.text is not None:
+            self.description = element.text.strip()
         elif self.name.lower().find("unk") == 0:
             self.description = "Unknown."
 
-        self.count = element.getAttribute('count') # type: str
-        self.template = (element.getAttribute('istemplate') == "1") # type: bool
+        self.count = element.get('count', '') # type: str
+        self.template = (element.get('istemplate') == "1") # type: bool
         self.options = [] # type: List[Option]
 
         self.is_link = False # type: bool
@@ -768,10 +1225,10 @@ class Basic:
         self.has_crossrefs = False # type: bool
 
         self.nativetype = None  # type: Optional[str]
-        if ntypes:
-            self.nativetype = ntypes.get(self.name)
+        if schema.ntypes:
+            self.nativetype = schema.ntypes.get(self.name)
             if self.nativetype:
-                TYPES_NATIVE[self.name] = self.nativetype
+                schema.types_native[self.name] = self.nativetype
                 if self.nativetype == "Ref":
                     self.is_link = True
                     self.has_links = True
@@ -781,43 +1238,57 @@ class Basic:
 
 class Enum(Basic):
     """This class represents the nif.xml <enum> tag."""
-    def __init__(self, element, ntypes):
-        Basic.__init__(self, element, ntypes)
+    def __init__(self, element, schema):
+        Basic.__init__(self, element, schema)
 
-        self.storage = element.getAttribute('storage')
-        self.prefix = element.getAttribute('prefix')
+        self.storage_name = element.get('storage', '') # type: str
+        self.storage = self.storage_name # type: str
+        self.prefix = element.get('prefix', '')
         # Find the native storage type
-        self.storage = TYPES_BASIC[self.storage].nativetype if TYPES_BASIC[self.storage].nativetype else TYPES_BASIC[self.storage].name
-        self.description = element.firstChild.nodeValue.strip()
+        storage = schema.types_basic.get(self.storage)
+        if storage is not None:
+            self.storage = storage.nativetype if storage.nativetype else storage.name
+        self.description = element.text.strip()
 
         self.nativetype = self.cname
-        TYPES_NATIVE[self.name] = self.nativetype
+        schema.types_native[self.name] = self.nativetype
 
         # Locate all special enumeration options
-        for option in element.getElementsByTagName('option'):
-            if self.prefix and option.hasAttribute('name'):
-                option.setAttribute('name', self.prefix + "_" + option.getAttribute('name'))
+        for option in element.iter('option'):
+            if self.prefix and 'name' in option.attrib:
+                option.set('name', self.prefix + "_" + option.get('name'))
             self.options.append(Option(option))
 
 class Flag(Enum):
     """This class represents the nif.xml <bitflags> tag."""
-    def __init__(self, element, ntypes):
-        Enum.__init__(self, element, ntypes)
+    def __init__(self, element, schema):
+        Enum.__init__(self, element, schema)
         for option in self.options:
             option.bit = option.value
             option.value = 1 << int(option.value)
 
 class Compound(Basic):
     """This class represents the nif.xml <compound> tag."""
-    def __init__(self, element, ntypes):
-        Basic.__init__(self, element, ntypes)
+    def __init__(self, element, schema, resolve=True):
+        """
+        @param resolve: Also look up the types which were built before, see resolve().
+            Otherwise the compound only depends on the element and the native types.
+        @type resolve: bool
+        """
+        Basic.__init__(self, element, schema)
 
         self.members = [] # type: List[Member]
         self.argument = False # type: bool
 
         # store all attribute data & calculate stuff
-        for member in element.getElementsByTagName('field'):
-            x = Member(member)
+        with _phase('members'):
+            fields = [(child, Member(child, schema) if child.tag in FIELD_TAGS else None) for child in element]
+        _count('members', sum(1 for _, mem in fields if mem))
+        with _phase('siblings'):
+            analyze_siblings(fields)
+        for _, x in fields:
+            if not x:
+                continue
             #***********************
             #** NIFLIB HACK BEGIN **
             #***********************
@@ -841,148 +1312,1128 @@ class Compound(Basic):
             # detect argument
             self.argument = bool(x.uses_argument)
 
-            # detect links & cross-references
-            mem = None
-            try:
-                mem = TYPES_BASIC[x.type]
-            except KeyError:
-                try:
-                    mem = TYPES_COMPOUND[x.type]
-                except KeyError:
-                    pass
-            if mem:
-                if mem.has_links:
-                    self.has_links = True
-                if mem.has_crossrefs:
-                    self.has_crossrefs = True
-
         # create duplicate chains for items that need it (only valid in current object scope)
-        #  prefer to use iterators to avoid O(n^2) but I don't know how to reset iterators
-        for outer in self.members:
-            atx = False
-            for inner in self.members:
-                if atx:
-                    if outer.name == inner.name: # duplicate
-                        outer.next_dup = inner
-                        break
-                elif outer == inner:
-                    atx = True
+        #  walk backwards so the next member of each name is already known
+        later = {}
+        for mem in reversed(self.members):
+            mem.next_dup = later.get(mem.name)
+            later[mem.name] = mem
+
+        self._index_members()
+
+        # the members which the size, condition and argument of each member read, if any, and the reverse
+        self.dependencies, self.dependents = self._dependency_graph(self.members, self.member_index)
+
+        if resolve:
+            self.resolve(element, schema)
+
+    def _index_members(self):
+        """Indexes the first member of each name, and the first member with each name as an array size."""
+        self.member_index = {} # type: Dict[str, Member]
+        self.ref_index = {} # type: Dict[str, Member]
+        for mem in self.members:
+            self.member_index.setdefault(mem.name, mem)
+            self.ref_index.setdefault(mem.arr1.lhs, mem)
+            self.ref_index.setdefault(mem.arr2.lhs, mem)
+
+    def share(self):
+        """
+        Shares the names and expressions of a compound built in another process with the types built in this one,
+        as building it here would: interns the names, and replaces each expression by that of Expression.parse().
+        """
+        self.name = sys.intern(self.name)
+        for mem in self.members:
+            mem.name = sys.intern(mem.name)
+            mem.type = sys.intern(mem.type)
+            mem.arg = sys.intern(mem.arg)
+            mem.template = sys.intern(mem.template)
+            # an expression of a member is always the one parsed from the text of its attribute
+            mem.arr1 = Expr.parse(mem.arr1._code)
+            mem.arr2 = Expr.parse(mem.arr2._code)
+            mem.cond = Expr.parse(mem.cond._code)
+            mem.vercond = Expr.parse(mem.vercond._code)
+        self._index_members()
+
+    def resolve(self, element, schema):
+        """
+        Finishes building with the types built before this one. A compound needs none: what it derives from
+        the types of its members is left to Schema.analyze_types(), as those may be declared after it.
+        """
+
+    @staticmethod
+    def _dependency_graph(members, index):
+        # type: (List[Member], Dict[str, Member]) -> Tuple[Dict[Member, List[Member]], Dict[Member, List[Member]]]
+        """
+        Returns the members each of members reads, resolving names through index, and the members reading each.
+        Members which read no other member are left out.
+        """
+        dependencies = {} # type: Dict[Member, List[Member]]
+        dependents = {} # type: Dict[Member, List[Member]]
+        for mem in members:
+            names = [mem.arg] if mem.arg else []
+            for expr in (mem.arr1, mem.arr2, mem.cond, mem.vercond):
+                if expr.lhs:
+                    names.extend(expr.get_names())
+            read = []
+            for name in dict.fromkeys(names):
+                # any of the members of the name may be the one present
+                dep = index.get(name)
+                while dep:
+                    if dep is not mem:
+                        read.append(dep)
+                        dependents.setdefault(dep, []).append(mem)
+                    dep = dep.next_dup
+            if read:
+                dependencies[mem] = read
+        return dependencies, dependents
+
+    def stream_members(self): # type: () -> List[Member]
+        """Returns the members in the order they are streamed."""
+        return self.members
+
+    def member_dependencies(self, mem): # type: (Member) -> List[Member]
+        """Returns the members which a member reads."""
+        return self.dependencies.get(mem, [])
+
+    def required_members(self, names): # type: (Iterable[str]) -> List[Member]
+        """Returns the members needed to decode the named members, those and all they depend on, in stream order."""
+        needed = set()
+        stack = []
+        for name in names:
+            mem = self.find_member(name, True)
+            while mem:
+                stack.append(mem)
+                mem = mem.next_dup
+        while stack:
+            mem = stack.pop()
+            if mem not in needed:
+                needed.add(mem)
+                stack.extend(self.member_dependencies(mem))
+        return [mem for mem in self.stream_members() if mem in needed]
 
     def find_member(self, name, inherit=False):
         """Find member by name"""
-        for mem in self.members:
-            if mem.name == name:
-                return mem
-        return None
+        return self.member_index.get(name)
 
     def find_first_ref(self, name):
         """Find first reference of name in class."""
-        for mem in self.members:
-            if mem.arr1 and mem.arr1.lhs == name:
-                return mem
-            elif mem.arr2 and mem.arr2.lhs == name:
-                return mem
-        return None
+        return self.ref_index.get(name)
 
     def has_arr(self):
-        """Tests recursively for members with an array size."""
-        for mem in self.members:
-            if mem.arr1.lhs or (mem.type in TYPES_COMPOUND and TYPES_COMPOUND[mem.type].has_arr()):
-                return True
-        return False
+        """Tests for members with an array size, also in the compounds of the members, see has_arrays."""
+        return self.has_arrays
 
 class Block(Compound):
     """This class represents the nif.xml <niobject> tag."""
-    def __init__(self, element, ntypes):
-        Compound.__init__(self, element, ntypes)
-        self.is_ancestor = (element.getAttribute('abstract') == "1")
-        inherit = element.getAttribute('inherit')
-        self.inherit = TYPES_BLOCK[inherit] if inherit else None
-        self.has_interface = (element.getElementsByTagName('interface') != [])
+    def __init__(self, element, schema, resolve=True):
+        Compound.__init__(self, element, schema, False)
+        self.is_ancestor = (element.get('abstract') == "1")
+        self.has_interface = (element.find('.//interface') is not None)
+        if resolve:
+            self.resolve(element, schema)
+
+    def resolve(self, element, schema):
+        """
+        Finishes building with the types built before this one: detects links & cross-references,
+        and inherits the members of the parent block.
+        """
+        self.inherit_name = element.get('inherit', '') # type: str
+        self.inherit = schema.types_block.get(self.inherit_name) if self.inherit_name else None # type: Optional[Block]
+
+        # the indexes flattened over the ancestors: members of the nearest block, references of the furthest
+        self.inherited_member_index = dict(self.inherit.inherited_member_index) if self.inherit else {}
+        self.inherited_member_index.update(self.member_index)
+        self.inherited_ref_index = dict(self.ref_index)
+        if self.inherit:
+            self.inherited_ref_index.update(self.inherit.inherited_ref_index)
+        self._ancestors = [self] + (self.inherit._ancestors if self.inherit else [])
+
+        # the dependency graph again, with names resolved to inherited members too,
+        # the ancestors keep the edges of their own members
+        self.dependencies, self.dependents = self._dependency_graph(self.members, self.inherited_member_index)
 
     def find_member(self, name, inherit=False):
         """Find member by name"""
-        ret = Compound.find_member(self, name)
-        if not ret and inherit and self.inherit:
-            ret = self.inherit.find_member(name, inherit)
-        return ret
+        return (self.inherited_member_index if inherit else self.member_index).get(name)
 
     def find_first_ref(self, name):
         """Find first reference of name in class"""
-        ret = None
-        if self.inherit:
-            ret = self.inherit.find_first_ref(name)
-        if not ret:
-            ret = Compound.find_first_ref(self, name)
-        return ret
+        return self.inherited_ref_index.get(name)
 
     def ancestors(self):
         """List all ancestors of this block"""
-        ancestors = []
-        parent = self
-        while parent:
-            ancestors.append(parent)
-            parent = parent.inherit
-        return ancestors
-
-def parse_xml(ntypes=None):
-    """Import elements into our classes"""
-    if os.path.exists("nif.xml"):
-        xml = parse("nif.xml")
-    elif os.path.exists("nifxml/nif.xml"):
-        xml = parse("nifxml/nif.xml")
-    else:
-        raise ImportError("nif.xml not found")
-
-    for element in xml.getElementsByTagName('version'):
-        instance = Version(element)
-        TYPES_VERSION[instance.num] = instance
-        NAMES_VERSION.append(instance.num)
-
-    for element in xml.getElementsByTagName('basic'):
-        instance = Basic(element, ntypes)
-        assert not instance.name in TYPES_BASIC
-        TYPES_BASIC[instance.name] = instance
-        NAMES_BASIC.append(instance.name)
-
-    for element in xml.getElementsByTagName('enum'):
-        instance = Enum(element, ntypes)
-        assert not instance.name in TYPES_ENUM
-        TYPES_ENUM[instance.name] = instance
-        NAMES_ENUM.append(instance.name)
-
-    for element in xml.getElementsByTagName('bitflags'):
-        instance = Flag(element, ntypes)
-        assert not instance.name in TYPES_FLAG
-        TYPES_FLAG[instance.name] = instance
-        NAMES_FLAG.append(instance.name)
-
-    for element in xml.getElementsByTagName('compound'):
-        instance = Compound(element, ntypes)
-        assert not instance.name in TYPES_COMPOUND
-        TYPES_COMPOUND[instance.name] = instance
-        NAMES_COMPOUND.append(instance.name)
-
-    for element in xml.getElementsByTagName('niobject'):
-        instance = Block(element, ntypes)
-        assert not instance.name in TYPES_BLOCK
-        TYPES_BLOCK[instance.name] = instance
-        NAMES_BLOCK.append(instance.name)
-
-    validate_xml()
-
-def validate_xml():
-    """Perform some basic validation on the data retrieved from the XML"""
-    assert TYPES_VERSION and NAMES_VERSION and len(TYPES_VERSION) == len(NAMES_VERSION)
-    assert TYPES_BASIC and NAMES_BASIC and len(TYPES_BASIC) == len(NAMES_BASIC)
-    assert TYPES_COMPOUND and NAMES_COMPOUND and len(TYPES_COMPOUND) == len(NAMES_COMPOUND)
-    assert TYPES_BLOCK and NAMES_BLOCK and len(TYPES_BLOCK) == len(NAMES_BLOCK)
-    assert TYPES_ENUM and NAMES_ENUM and len(TYPES_ENUM) == len(NAMES_ENUM)
-    assert TYPES_FLAG and NAMES_FLAG and len(TYPES_FLAG) == len(NAMES_FLAG)
-
-    assert all(name for name in NAMES_VERSION)
-    assert all(name for name in NAMES_BASIC)
-    assert all(name for name in NAMES_COMPOUND)
-    assert all(name for name in NAMES_BLOCK)
-    assert all(name for name in NAMES_ENUM)
-    assert all(name for name in NAMES_FLAG)
+        return list(self._ancestors)
+
+    def stream_members(self): # type: () -> List[Member]
+        """Returns the members of the block and its ancestors in the order they are streamed."""
+        return [mem for ancestor in reversed(self._ancestors) for mem in ancestor.members]
+
+    def member_dependencies(self, mem): # type: (Member) -> List[Member]
+        """Returns the members which a member of the block or of an ancestor reads."""
+        for ancestor in self._ancestors:
+            if mem in ancestor.dependencies:
+                return ancestor.dependencies[mem]
+        return []
+
+# Top-level tags in load order, with the rank each must not precede in the document
+# for a single streaming pass to see the same tables as a pass per tag kind.
+# Versions depend on nothing, and enums and bitflags only depend on basics.
+TAG_RANKS = {'version': -1, 'basic': 0, 'enum': 1, 'bitflags': 1, 'compound': 2, 'niobject': 3}
+
+# The kinds of XML schema, kfm.xml uses the same tags as nif.xml but has no <niobject> or <bitflags>
+NIF = 'nif'
+KFM = 'kfm'
+
+def find_xml(path=None, kind=NIF, directory=None): # type: (Optional[str], str, Optional[str]) -> str
+    """
+    Locates nif.xml, or kfm.xml, in the working directory or the nifxml (kfmxml) submodule.
+    @param directory: Look in this directory instead of the working directory, also for a relative path.
+    @type directory: str
+    """
+    if path:
+        path = os.path.join(directory or '', path)
+        if not os.path.exists(path):
+            raise ImportError("%s not found" % path)
+        return path
+    filename = kind + ".xml"
+    if os.path.exists(os.path.join(directory or '', filename)):
+        return os.path.join(directory or '', filename)
+    elif os.path.exists(os.path.join(directory or '', kind + "xml/" + filename)):
+        return os.path.join(directory or '', kind + "xml/" + filename)
+    raise ImportError(filename + " not found")
+
+class Schema:
+    """
+    All the tables parsed from one XML file, so several files or revisions can be loaded side by side.
+    The module globals are a view of the active schema, which the code generators and the helpers
+    they use (class_name, Expression.code) read.
+
+    To share one schema between worker processes, parse it and call freeze() before forking:
+    the workers then reuse its pages copy-on-write, without the garbage collector touching them.
+
+    @ivar path: The XML file the schema was loaded from.
+    @ivar kind: NIF or KFM, the kind of XML file.
+    @ivar ntypes: The XML to native type mapping.
+    @ivar roots: The names of the types the compounds and blocks were limited to, or None if all were loaded.
+    @ivar types_native: The native C++ type of each type name.
+    @ivar types_basic: The <basic> types by name.  Likewise types_enum, types_flag, types_compound, types_block.
+    @ivar types_version: The <version> tags by number.
+    @ivar version_names: The number of each <version> tag as in the XML, by packed number.
+    @ivar names_basic: The <basic> type names in document order.  Likewise names_enum, names_flag,
+        names_compound, names_block, names_version.
+    @ivar children: The blocks which directly inherit each block, by name of the parent.
+    @ivar users: The compounds and blocks with a member of each type, by name of the type.
+    @ivar fingerprints: The hash of the element each type was built from, by tag and name, in load order.
+        None unless the schema was loaded to be incrementally reparsed.
+    @ivar unresolved: Every reference which does not resolve, as validate_xml() found when the schema was loaded.
+    """
+    def __init__(self, path=None, ntypes=None, roots=None, kind=NIF, incremental=False):
+        self.path = path # type: Optional[str]
+        self.kind = kind # type: str
+        self.ntypes = ntypes # type: Optional[Dict[str, str]]
+        self.roots = roots # type: Optional[FrozenSet[str]]
+        self.types_native = {'TEMPLATE': 'T'} # type: Dict[str, str]
+        self.types_basic = {} # type: Dict[str, Basic]
+        self.types_enum = {} # type: Dict[str, Enum]
+        self.types_flag = {} # type: Dict[str, Flag]
+        self.types_compound = {} # type: Dict[str, Compound]
+        self.types_block = {} # type: Dict[str, Block]
+        self.types_version = {} # type: Dict[str, Version]
+        self.names_basic = [] # type: List[str]
+        self.names_compound = [] # type: List[str]
+        self.names_enum = [] # type: List[str]
+        self.names_flag = [] # type: List[str]
+        self.names_block = [] # type: List[str]
+        self.names_version = [] # type: List[str]
+        self.version_names = {} # type: Dict[int, str]
+        self.children = {} # type: Dict[str, List[Block]]
+        self.users = {} # type: Dict[str, List[Compound]]
+        self.fingerprints = {} if incremental else None # type: Optional[Dict[Tuple[str, str], bytes]]
+        self.unresolved = [] # type: List[str]
+        self._views = {} # type: Dict[Tuple[int, int, int], SchemaView]
+
+    def __getstate__(self):
+        """Pickle without the views, which are rebuilt on demand."""
+        state = dict(self.__dict__)
+        state['_views'] = {}
+        return state
+
+    def tables(self):
+        """Returns all tables, in the order of xml_tables()."""
+        return (self.types_native, self.types_basic, self.types_enum, self.types_flag, self.types_compound,
+                self.types_block, self.types_version, self.names_basic, self.names_compound, self.names_enum,
+                self.names_flag, self.names_block, self.names_version)
+
+    def load_element(self, element, fingerprint=None):
+        """Converts a top-level XML element into its class and adds it to the tables."""
+        if fingerprint is None and self.fingerprints is not None:
+            # before the classes edit the element
+            fingerprint = _fingerprint(element)
+        with _phase('build ' + element.tag):
+            if element.tag == 'version':
+                instance = Version(element)
+            else:
+                cls = {'basic': Basic, 'enum': Enum, 'bitflags': Flag, 'compound': Compound, 'niobject': Block}
+                instance = cls[element.tag](element, self)
+        _count('build ' + element.tag, 1)
+        return self.add(element.tag, instance, fingerprint)
+
+    def add(self, tag, instance, fingerprint):
+        """Adds a type built from an element of this or an earlier revision of the XML to the tables."""
+        if self.fingerprints is not None:
+            self.fingerprints[(tag, instance.name)] = fingerprint
+        if tag == 'version':
+            self.types_version[instance.num] = instance
+            self.names_version.append(instance.num)
+            self.version_names.setdefault(instance.number, instance.num)
+            return instance
+
+        types, names = {
+            'basic': (self.types_basic, self.names_basic),
+            'enum': (self.types_enum, self.names_enum),
+            'bitflags': (self.types_flag, self.names_flag),
+            'compound': (self.types_compound, self.names_compound),
+            'niobject': (self.types_block, self.names_block),
+        }[tag]
+        assert not instance.name in types
+        types[instance.name] = instance
+        names.append(instance.name)
+        if instance.nativetype:
+            self.types_native[instance.name] = instance.nativetype
+        if isinstance(instance, Compound):
+            for type_name in dict.fromkeys(mem.type for mem in instance.members):
+                self.users.setdefault(type_name, []).append(instance)
+        if isinstance(instance, Block) and instance.inherit:
+            self.children.setdefault(instance.inherit.name, []).append(instance)
+        return instance
+
+    def resolve_types(self):
+        """
+        Points each member of the compounds and blocks at its type, looking the name up in the basic, compound,
+        enum and bitflags types in turn, see Member.type_obj. Called once all types are loaded,
+        as a member may be of a type declared after it.
+        """
+        tables = (self.types_basic, self.types_compound, self.types_enum, self.types_flag)
+        for types in (self.types_compound, self.types_block):
+            for compound in types.values():
+                for mem in compound.members:
+                    for table in tables:
+                        type_obj = table.get(mem.type)
+                        if type_obj is not None:
+                            break
+                    mem.type_obj = type_obj
+
+    def analyze_types(self):
+        """
+        Derives the properties of the compounds and blocks which depend on the types of their members,
+        once the types are resolved, see resolve_types(). Each is propagated from the members to the compounds
+        using them until nothing changes, so neither declaration order nor recursive types matter:
+        has_links and has_crossrefs, has_arrays (see has_arr()), has_template for members of type TEMPLATE,
+        of TEMPLATE template, or of a compound which has one and is given no template, and is_recursive
+        for compounds which contain themselves through the types of their members.
+        Each is derived anew, so none is left over from an earlier revision, see _load_incremental():
+
+        >>> import tempfile
+        >>> xml = '''<kfmxml><version num="2.2.0.0">KF 2.2</version><basic name="uint">Int.</basic>
+        ...     <basic name="Ref">Link.</basic><compound name="Event"><add name="Time" type="Key">Time.</add></compound>
+        ...     <compound name="Key"><add name="Value" type="%s">Value.</add></compound></kfmxml>'''
+        >>> with tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False) as f:
+        ...     _ = f.write(xml % 'Ref')
+        >>> old = parse_xml({'Ref': 'Ref'}, f.name, cache=False, activate=False, kind=KFM, incremental=True)
+        >>> with open(f.name, 'w') as f:
+        ...     _ = f.write(xml % 'uint')
+        >>> new = parse_xml({'Ref': 'Ref'}, f.name, cache=False, activate=False, kind=KFM, previous=old)
+        >>> full = parse_xml({'Ref': 'Ref'}, f.name, cache=False, activate=False, kind=KFM)
+        >>> os.remove(f.name)
+        >>> old.types_compound['Event'].has_links, new.types_compound['Event'].has_links
+        (True, False)
+        >>> full.types_compound['Event'].has_links
+        False
+        """
+        compounds = list(self.types_compound.values()) + list(self.types_block.values())
+        # the compounds and blocks with a member of each type, with the member
+        users = {} # type: Dict[Basic, List[Tuple[Compound, Member]]]
+        for compound in compounds:
+            compound.has_links = compound.is_link
+            compound.has_crossrefs = compound.is_crossref
+            compound.has_arrays = any(mem.arr1.lhs for mem in compound.members) # type: bool
+            compound.has_template = any(mem.type == 'TEMPLATE' or mem.template == 'TEMPLATE'
+                                        for mem in compound.members) # type: bool
+            compound.is_recursive = False # type: bool
+            for mem in compound.members:
+                if mem.type_obj is not None:
+                    users.setdefault(mem.type_obj, []).append((compound, mem))
+
+        types = list(self.types_basic.values()) + compounds
+        self._propagate('has_links', types, users)
+        self._propagate('has_crossrefs', types, users)
+        self._propagate('has_arrays', compounds, users)
+        self._propagate('has_template', compounds, users, lambda mem: not mem.template)
+
+        for cycle in self._cycles(self.types_compound.values()):
+            for compound in cycle:
+                compound.is_recursive = True
+
+    @staticmethod
+    def _propagate(attr, types, users, passes=None):
+        # type: (str, Iterable[Basic], Dict[Basic, List[Tuple[Compound, Member]]], Optional[Callable[[Member], bool]]) -> None
+        """Sets a property on every type reaching one which has it through members which pass it on."""
+        pending = [type_obj for type_obj in types if getattr(type_obj, attr)]
+        while pending:
+            for user, mem in users.get(pending.pop(), ()):
+                if not getattr(user, attr) and (passes is None or passes(mem)):
+                    setattr(user, attr, True)
+                    pending.append(user)
+
+    @staticmethod
+    def _cycles(compounds): # type: (Iterable[Compound]) -> List[List[Compound]]
+        """
+        Returns the compounds on each cycle of the graph of compounds and the compounds of their members:
+        the strongly connected components of more than one compound, or of one with a member of its own type.
+        """
+        index = {} # type: Dict[Compound, int]
+        lowlink = {} # type: Dict[Compound, int]
+        stack = [] # type: List[Compound]
+        on_stack = set()
+        cycles = []
+        for root in compounds:
+            if root in index:
+                continue
+            # Tarjan's algorithm, with an explicit stack of the compounds being visited and their next member
+            visiting = [(root, 0)]
+            while visiting:
+                compound, i = visiting.pop()
+                if i == 0:
+                    index[compound] = lowlink[compound] = len(index)
+                    stack.append(compound)
+                    on_stack.add(compound)
+                elif isinstance(compound.members[i - 1].type_obj, Compound):
+                    # back from the compound of the previous member
+                    lowlink[compound] = min(lowlink[compound], lowlink[compound.members[i - 1].type_obj])
+                while i < len(compound.members):
+                    target = compound.members[i].type_obj
+                    i += 1
+                    if not isinstance(target, Compound):
+                        continue
+                    if target not in index:
+                        visiting.append((compound, i))
+                        visiting.append((target, 0))
+                        break
+                    if target in on_stack:
+                        lowlink[compound] = min(lowlink[compound], index[target])
+                else:
+                    if lowlink[compound] == index[compound]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member is compound:
+                                break
+                        if len(component) > 1 or any(mem.type_obj is compound for mem in compound.members):
+                            cycles.append(component)
+        return cycles
+
+    def version_number(self, version): # type: (str) -> int
+        """Translates a legible version number to the packed form, looking up the <version> tags first."""
+        tag = self.types_version.get(version)
+        return tag.number if tag else version2number(version)
+
+    def version_string(self, number): # type: (int) -> str
+        """Translates a packed version number to the legible form of its <version> tag, if there is one."""
+        name = self.version_names.get(number)
+        return name if name is not None else number2version(number)
+
+    def view(self, version, userver=0, userver2=0): # type: (Union[int, str], int, int) -> SchemaView
+        """
+        Returns the compounds and blocks as they are in one version, built on first use.
+        @param version: The file version, packed or as in the XML.
+        @type version: Union[int, str]
+        @param userver: The user version.
+        @type userver: int
+        @param userver2: The user version 2.
+        @type userver2: int
+        """
+        if isinstance(version, str):
+            version = self.version_number(version)
+        key = (version, userver, userver2)
+        try:
+            return self._views[key]
+        except KeyError:
+            view = self._views[key] = SchemaView(self, *key)
+            return view
+
+    def activate(self):
+        """Makes the module globals a view of this schema."""
+        for table, contents in zip(xml_tables(), self.tables()):
+            table.clear()
+            if isinstance(table, dict):
+                table.update(contents)
+            else:
+                table.extend(contents)
+        return self
+
+    def freeze(self):
+        """
+        Moves the schema, and everything else alive, out of reach of the garbage collector
+        so that processes forked afterwards share it copy-on-write. See gc.freeze().
+        """
+        gc.collect()
+        gc.freeze()
+        return self
+
+class SchemaView:
+    """
+    The compounds and blocks of a schema as they are in one version of the format.
+    Members which do not exist in the version are left out. Copies of the others are made without
+    the version checks which always hold, so only the conditions on other data remain.
+    A vercond which reads anything besides the version is simplified for the version.
+    @ivar schema: The schema the view is of.
+    @ivar version: The packed file version.
+    @ivar userver: The user version.
+    @ivar userver2: The user version 2.
+    @ivar members: The members of each compound and block in this version, by name, without those inherited.
+    """
+    def __init__(self, schema, version, userver=0, userver2=0):
+        self.schema = schema # type: Schema
+        self.version = version # type: int
+        self.userver = userver # type: int
+        self.userver2 = userver2 # type: int
+        self._env = dict(zip(VERSION_TERMINALS, (version, userver, userver2)))
+        self.members = {} # type: Dict[str, List[Member]]
+        for types in (schema.types_compound, schema.types_block):
+            for name, compound in types.items():
+                self.members[name] = [mem for mem in map(self._specialize, compound.members) if mem]
+
+    def _specialize(self, mem): # type: (Member) -> Optional[Member]
+        """Returns None if mem does not exist in this version, else mem or a copy without its version checks."""
+        if mem.ver1 and self.version < mem.ver1:
+            return None
+        if mem.ver2 and self.version > mem.ver2:
+            return None
+        if mem.userver is not None and self.userver != mem.userver:
+            return None
+        if mem.userver2 is not None and self.userver2 != mem.userver2:
+            return None
+        vercond = mem.vercond.simplify(self._env, True)
+        if not vercond.op and vercond.lhs:
+            value = Expression._constant(vercond.lhs)
+            if value is not None:
+                if not value:
+                    return None
+                vercond = Expr.parse('')
+        if not mem.ver1 and not mem.ver2 and mem.userver is None and mem.userver2 is None and vercond is mem.vercond:
+            return mem
+        mem = copy.copy(mem)
+        mem.ver1 = mem.ver2 = mem.userver = mem.userver2 = None
+        mem.vercond = vercond
+        return mem
+
+    def inherited_members(self, name): # type: (str) -> List[Member]
+        """Returns the members of a block and its ancestors in this version, the root ancestor's first."""
+        block = self.schema.types_block[name]
+        return [mem for ancestor in reversed(block.ancestors()) for mem in self.members[ancestor.name]]
+
+class Profile:
+    """
+    Where the time and memory of loading a schema go, see the profile parameter of parse_xml().
+    Phases nest, and the figures of a phase include those of the phases within it: each "build" of a tag kind
+    includes the "members" of its compounds, which include the "expressions" of the members.
+
+    >>> profile = Profile()
+    >>> with profile.phase('example'):
+    ...     profile.count('example', 2)
+    >>> sorted(profile.phases['example'])
+    ['blocks', 'calls', 'objects', 'seconds']
+    >>> profile.phases['example']['objects']
+    2
+
+    @ivar path: The XML file which was loaded.
+    @ivar loader: How the schema was loaded: 'resident', 'cache', 'incremental', 'stream' or 'tree'.
+    @ivar phases: The figures of each phase by name: how many times it ran ('calls'), its wall time ('seconds'),
+        the memory blocks it left allocated ('blocks'), and the number of objects it built ('objects').
+    """
+    def __init__(self):
+        self.path = None # type: Optional[str]
+        self.loader = None # type: Optional[str]
+        self.phases = {} # type: Dict[str, Dict[str, Union[int, float]]]
+
+    def _stats(self, name): # type: (str) -> Dict[str, Union[int, float]]
+        """Returns the figures of a phase."""
+        try:
+            return self.phases[name]
+        except KeyError:
+            stats = self.phases[name] = {'calls': 0, 'seconds': 0.0, 'blocks': 0, 'objects': 0}
+            return stats
+
+    @contextmanager
+    def phase(self, name): # type: (str) -> Iterator[None]
+        """Adds the time and memory blocks of running the body of the with statement to a phase."""
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stats = self._stats(name)
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['blocks'] += sys.getallocatedblocks() - blocks
+
+    def count(self, name, objects): # type: (str, int) -> None
+        """Adds to the number of objects built by a phase."""
+        self._stats(name)['objects'] += objects
+
+    def timed(self, name, iterable): # type: (str, Iterable[Any]) -> Iterator[Any]
+        """Yields the items of iterable, adding the time spent getting each one to a phase."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def to_dict(self): # type: () -> Dict[str, Any]
+        """Returns the profile as a dict of plain values."""
+        return {'path': self.path, 'loader': self.loader, 'phases': self.phases}
+
+    def dump(self, f): # type: (IO[str]) -> None
+        """Writes the profile to a text file as one line of JSON."""
+        f.write(json.dumps(self.to_dict(), sort_keys=True) + '\n')
+
+# The profile of the parse_xml() in progress, if any
+_profile = None # type: Optional[Profile]
+
+def _phase(name): # type: (str) -> ContextManager[None]
+    """Adds running the body of the with statement to a phase of the profile in progress, if any."""
+    return _profile.phase(name) if _profile is not None else nullcontext()
+
+def _count(name, objects): # type: (str, int) -> None
+    """Adds to the number of objects built by a phase of the profile in progress, if any."""
+    if _profile is not None:
+        _profile.count(name, objects)
+
+def xml_tables():
+    """Returns the global tables, in the order of Schema.tables()."""
+    return (TYPES_NATIVE, TYPES_BASIC, TYPES_ENUM, TYPES_FLAG, TYPES_COMPOUND, TYPES_BLOCK, TYPES_VERSION,
+            NAMES_BASIC, NAMES_COMPOUND, NAMES_ENUM, NAMES_FLAG, NAMES_BLOCK, NAMES_VERSION)
+
+def reset_xml():
+    """Empties the global tables."""
+    Schema().activate()
+
+def cache_file(path, ntypes, roots=None): # type: (str, Optional[Dict[str, str]], Optional[FrozenSet[str]]) -> str
+    """Returns the cache file for parsing path with ntypes and roots."""
+    location = hashlib.sha256(os.path.realpath(path).encode('utf-8', 'surrogateescape'))
+    revision = hashlib.sha256()
+    for source in (path, __file__):
+        with open(source, 'rb') as f:
+            revision.update(f.read())
+    options = hashlib.sha256(repr(sorted(ntypes.items()) if ntypes else None).encode('utf-8'))
+    options.update(repr(sorted(roots) if roots is not None else None).encode('utf-8'))
+    return os.path.join(CACHE_PATH, CACHE_FILE.format(location.hexdigest()[:16], revision.hexdigest(),
+                                                      options.hexdigest()[:16]))
+
+def _load_cache(filename): # type: (str) -> Optional[Schema]
+    """Loads a schema from a cache file. Returns None if there is no usable cache."""
+    try:
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+def _save_cache(filename, schema):
+    """Writes a schema to a cache file, replacing it atomically, also while other processes write it."""
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        fd, temp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(filename))
+    except OSError:
+        return # caching is only an optimization
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(schema, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, filename)
+        temp = None
+        _prune_cache(filename)
+    except OSError:
+        pass
+    finally:
+        if temp is not None:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+def _prune_cache(filename):
+    """
+    Removes the caches of the XML of a cache file just written which can not be used again: those of
+    other revisions of it, and the oldest of the others beyond CACHE_VARIANTS.
+    """
+    directory, name = os.path.split(filename)
+    location, revision, _ = name[:-len('.pickle')].split('-')[1:]
+    current = []
+    for other in os.listdir(directory):
+        parts = other[:-len('.pickle')].split('-')
+        if other == name or not other.endswith('.pickle') or len(parts) != 4 or parts[:2] != ['nifxml', location]:
+            continue
+        other = os.path.join(directory, other)
+        try:
+            if parts[2] != revision:
+                os.remove(other)
+            else:
+                current.append((os.path.getmtime(other), other))
+        except OSError:
+            pass # removed by another process
+    for _, other in sorted(current)[:max(0, len(current) + 1 - CACHE_VARIANTS)]:
+        try:
+            os.remove(other)
+        except OSError:
+            pass
+
+def _fingerprint(element): # type: (Element) -> bytes
+    """Hashes the tags, attributes and text of a top-level element and its children."""
+    return hashlib.sha1(repr([(e.tag, e.attrib, e.text) for e in element.iter()]).encode('utf-8')).digest()
+
+def _references(element): # type: (Element) -> List[str]
+    """Returns the names of the types building an element reads: its parent, storage, and field types."""
+    names = [element.get('inherit'), element.get('storage')]
+    for field in (child for child in element if child.tag in FIELD_TAGS):
+        names.extend((field.get('type'), field.get('template')))
+    return names
+
+def _load_tree(schema, workers=1, min_parallel=None):
+    """
+    Loads the whole document, then walks it once per tag kind.
+    If the schema has roots, only the compounds and blocks they depend on are loaded.
+    With several workers and at least min_parallel compounds and blocks, by default PARALLEL_MIN_TYPES,
+    those are built in worker processes, see _build_parallel().
+    """
+    with _phase('read xml'):
+        xml = parse(schema.path).getroot()
+    with _phase('dependencies'):
+        wanted = _dependencies(xml, schema.roots) if schema.roots is not None else None
+    pending = [] # type: List[Element]
+    for tag in sorted(TAG_RANKS, key=TAG_RANKS.get):
+        for element in xml.iter(tag):
+            if TAG_RANKS[tag] < TAG_RANKS['compound']:
+                schema.load_element(element)
+            elif wanted is None or element in wanted:
+                pending.append(element)
+    if workers > 1 and len(pending) >= (PARALLEL_MIN_TYPES if min_parallel is None else min_parallel):
+        built = _build_parallel(schema, pending, workers)
+        if built is not None:
+            for element, instance in zip(pending, built):
+                fingerprint = _fingerprint(element) if schema.fingerprints is not None else None
+                with _phase('resolve ' + element.tag):
+                    instance.share()
+                    instance.resolve(element, schema)
+                schema.add(element.tag, instance, fingerprint)
+            return
+    for element in pending:
+        schema.load_element(element)
+
+# The schema and the elements forked workers build from, see _build_parallel()
+_build_state = None # type: Optional[Tuple[Schema, List[Element], Dict[str, str]]]
+
+def _build_parallel(schema, elements, workers):
+    # type: (Schema, List[Element], int) -> Optional[List[Compound]]
+    """
+    Builds compounds and blocks in a pool of forked worker processes, unresolved, see Compound.resolve(),
+    nor sharing names and expressions with the types of this process, see Compound.share().
+    Building one only depends on the types before the compounds, and on which of the compounds and blocks
+    before it have a native type, so each worker builds a run of consecutive elements from its own copy
+    of the tables. Resolving their links and parents is left to the caller, in document order.
+    Returns None if processes cannot be forked.
+    """
+    global _build_state
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        return None
+    runs = min(len(elements), workers * 4)
+    bounds = [(len(elements) * i // runs, len(elements) * (i + 1) // runs) for i in range(runs)]
+    _build_state = (schema, elements, dict(schema.types_native))
+    try:
+        with _phase('build parallel'), context.Pool(workers, initializer=_start_worker) as pool:
+            built = pool.map(_build_run, bounds, chunksize=1)
+    finally:
+        _build_state = None
+    _count('build parallel', len(elements))
+    return [instance for run in built for instance in run]
+
+def _start_worker():
+    """Stops a forked worker from recording into the profile of its parent, which never sees it."""
+    global _profile
+    _profile = None
+
+def _build_run(bounds): # type: (Tuple[int, int]) -> List[Compound]
+    """Builds the unresolved compounds and blocks of a run of the elements of _build_state in a worker."""
+    schema, elements, types_native = _build_state
+    start, end = bounds
+    # the native types the compounds and blocks before the run would have added
+    schema.types_native = dict(types_native)
+    if schema.ntypes:
+        for element in elements[:start]:
+            nativetype = schema.ntypes.get(element.get('name', ''))
+            if nativetype:
+                schema.types_native[element.get('name', '')] = nativetype
+    cls = {'compound': Compound, 'niobject': Block}
+    return [cls[element.tag](element, schema, False) for element in elements[start:end]]
+
+def _dependencies(xml, roots): # type: (Element, FrozenSet[str]) -> Set[Element]
+    """
+    Returns the <compound> and <niobject> elements needed to build the root types: the roots,
+    and recursively their ancestors, the types and templates of their fields,
+    and the blocks their fields' expressions test for.
+    Roots may be given by XML name or C++ class name.
+    """
+    by_name = {}
+    for element in xml:
+        if element.tag in ('compound', 'niobject'):
+            by_name[element.get('name')] = element
+            by_name.setdefault(class_name(element.get('name'), {}), element)
+    declared = {element.get('name') for element in xml if element.tag in TAG_RANKS}
+    unknown = [name for name in roots if name not in by_name and name not in declared]
+    if unknown:
+        raise KeyError("no type named %s" % ', '.join(sorted(unknown)))
+
+    wanted = set()
+    pending = [by_name[name] for name in roots if name in by_name]
+    while pending:
+        element = pending.pop()
+        if element in wanted:
+            continue
+        wanted.add(element)
+        names = _references(element)
+        for field in (child for child in element if child.tag in FIELD_TAGS):
+            for attr in EXPRESSION_ATTRIBUTES:
+                names.extend(Expr.parse(field.get(attr, '')).get_terminals())
+        pending.extend(by_name[name] for name in names if name in by_name)
+    return wanted
+
+def _load_incremental(schema, previous): # type: (Schema, Schema) -> bool
+    """
+    Loads the whole document like _load_tree, reusing the types of a schema of an earlier revision
+    for the elements which are unchanged and reference no rebuilt, added or removed type.
+    Returns False without loading if previous was parsed differently or its types were reordered.
+    A type is also rebuilt if a type it reads is, wherever that is declared, so previous stays as it was:
+
+    >>> import tempfile
+    >>> xml = '''<kfmxml><version num="2.2.0.0">KF 2.2</version><basic name="uint">Int.</basic>
+    ...     <compound name="Event"><add name="Time" type="Key">Time.</add></compound>
+    ...     <compound name="Key"><add name="Value" type="uint">%s</add></compound></kfmxml>'''
+    >>> with tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False) as f:
+    ...     _ = f.write(xml % 'Value.')
+    >>> old = parse_xml(path=f.name, cache=False, activate=False, kind=KFM, incremental=True)
+    >>> with open(f.name, 'w') as f:
+    ...     _ = f.write(xml % 'Edited.')
+    >>> new = parse_xml(path=f.name, cache=False, activate=False, kind=KFM, previous=old)
+    >>> os.remove(f.name)
+    >>> new.types_compound['Event'].members[0].type_obj is new.types_compound['Key']
+    True
+    >>> old.types_compound['Event'].members[0].type_obj is old.types_compound['Key']
+    True
+    """
+    if previous.fingerprints is None or schema.roots is not None:
+        return False
+    if (previous.kind, previous.ntypes, previous.roots) != (schema.kind, schema.ntypes, None):
+        return False
+    order = sorted(TAG_RANKS, key=TAG_RANKS.get)
+    with _phase('read xml'):
+        xml = parse(schema.path).getroot()
+    elements = [element for tag in order for element in xml.iter(tag)]
+    keys = [(element.tag, element.get('num' if element.tag == 'version' else 'name', '')) for element in elements]
+    # the tables only depend on the order of the types of each tag
+    old_keys = sorted(previous.fingerprints, key=lambda key: order.index(key[0]))
+    kept = set(keys) & set(old_keys)
+    if [key for key in keys if key in kept] != [key for key in old_keys if key in kept]:
+        return False
+
+    old_types = {}
+    for tag, types in (('version', previous.types_version), ('basic', previous.types_basic),
+                       ('enum', previous.types_enum), ('bitflags', previous.types_flag),
+                       ('compound', previous.types_compound), ('niobject', previous.types_block)):
+        old_types.update(((tag, name), instance) for name, instance in types.items())
+    # names of the types which are new, removed, or rebuilt
+    dirty = {name for _, name in set(keys).symmetric_difference(old_keys)}
+    fingerprints = []
+    rebuild = [] # type: List[bool]
+    readers = {} # type: Dict[str, List[int]]
+    for i, (element, key) in enumerate(zip(elements, keys)):
+        with _phase('fingerprint'):
+            fingerprint = _fingerprint(element)
+        fingerprints.append(fingerprint)
+        # members also look up their own name in the native types
+        for name in _references(element) + [field.get('name') for field in element if field.tag in FIELD_TAGS]:
+            readers.setdefault(name, []).append(i)
+        rebuild.append(key not in kept or previous.fingerprints[key] != fingerprint)
+        if rebuild[-1]:
+            dirty.add(key[1])
+    # also the readers of a rebuilt type declared after them, so a type is only shared with previous
+    # if the types it reads are too, and resolving and analyzing the types leaves previous as it was
+    pending = list(dirty)
+    while pending:
+        for i in readers.get(pending.pop(), ()):
+            if not rebuild[i]:
+                rebuild[i] = True
+                if keys[i][1] not in dirty:
+                    dirty.add(keys[i][1])
+                    pending.append(keys[i][1])
+    for element, key, fingerprint, rebuilt in zip(elements, keys, fingerprints, rebuild):
+        if rebuilt:
+            schema.load_element(element, fingerprint)
+        else:
+            schema.add(key[0], old_types[key], fingerprint)
+            _count('reuse ' + key[0], 1)
+    return True
+
+def _load_streaming(schema): # type: (Schema) -> bool
+    """
+    Loads each top-level element as soon as it is closed, then frees it.
+    Returns False without finishing if the document is not in load order.
+    """
+    root = None
+    depth = 0
+    rank = -1
+    events = iterparse(schema.path, events=('start', 'end'))
+    if _profile is not None:
+        events = _profile.timed('read xml', events)
+    for event, element in events:
+        if event == 'start':
+            if root is None:
+                root = element
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        tag_rank = TAG_RANKS.get(element.tag)
+        if tag_rank is not None:
+            if tag_rank < rank:
+                return False
+            rank = max(rank, tag_rank)
+            schema.load_element(element)
+        root.clear()
+    return True
+
+def parse_xml(ntypes=None, path=None, streaming=True, cache=True, activate=True, roots=None, kind=NIF,
+              incremental=False, previous=None, profile=None, workers=1, strict=False,
+              min_parallel=None):
+    """
+    Import elements into our classes
+    @param ntypes: The XML to native type mapping.
+    @type ntypes: Dict[str, str]
+    @param path: The XML file to load, defaults to nif.xml in the working directory or the nifxml submodule.
+    @type path: str
+    @param streaming: Load in a single pass with iterparse instead of keeping the whole document.
+    @type streaming: bool
+    @param cache: Reuse the tables from a previous parse of the same XML and ntypes, and store them for later runs.
+    @type cache: bool
+    @param activate: Make the module globals a view of the new schema.
+    @type activate: bool
+    @param roots: Only build these compounds and blocks and the ones they depend on, instead of all of them.
+    @type roots: Iterable[str]
+    @param kind: NIF or KFM, the kind of XML file, which also names the default file.
+    @type kind: str
+    @param incremental: Fingerprint the elements, so the schema can be passed as previous to a later parse.
+    @type incremental: bool
+    @param previous: A schema loaded with incremental from an earlier revision of the XML. The types of
+        the elements which did not change, and reference no type which did, are shared with it instead of rebuilt,
+        leaving it as it was.
+    @type previous: Schema
+    @param profile: Record the time and memory of each phase of loading here. If not given and
+        the NIFXML_PROFILE environment variable names a file, a profile is appended to that file.
+    @type profile: Profile
+    @param workers: Build the compounds and blocks in this many processes, if there are at least
+        min_parallel of them. Loads the whole document rather than streaming it. With the default min_parallel,
+        the current nif.xml has too few for the workers to pay off, and loads in this process.
+    @type workers: int
+    @param strict: Raise a ValueError listing every reference which does not resolve, if any,
+        instead of only recording them in Schema.unresolved.
+    @type strict: bool
+    @param min_parallel: The fewest compounds and blocks to build with workers, by default PARALLEL_MIN_TYPES.
+    @type min_parallel: int
+    @return: The parsed schema.
+    @rtype: Schema
+    """
+    path = find_xml(path, kind)
+    profile_file = None
+    if profile is None and os.environ.get(PROFILE_VARIABLE):
+        profile = Profile()
+        profile_file = os.environ[PROFILE_VARIABLE]
+    global _profile
+    outer_profile, _profile = _profile, profile
+    try:
+        with _phase('parse_xml'):
+            schema, loader = _load_schema(path, ntypes, streaming, cache, roots, kind, incremental, previous, workers,
+                                          min_parallel)
+            if strict and schema.unresolved:
+                raise _unresolved_error(path, schema.unresolved)
+            if activate:
+                with _phase('activate'):
+                    schema.activate()
+    finally:
+        _profile = outer_profile
+    if profile is not None:
+        profile.path = path
+        profile.loader = loader
+        if profile_file:
+            with open(profile_file, 'a') as f:
+                profile.dump(f)
+    return schema
+
+def _load_schema(path, ntypes, streaming, cache, roots, kind, incremental, previous, workers=1,
+                 min_parallel=None):
+    """Loads and validates a schema for parse_xml(). Returns it with the name of the loader, see Profile.loader."""
+    roots = frozenset(roots) if roots is not None else None
+    incremental = incremental or previous is not None
+    with _phase('cache key'):
+        filename = cache_file(path, ntypes, roots) if cache else None
+    schema = RESIDENT.get(filename) if filename and RESIDENT is not None else None
+    if schema is not None and (schema.fingerprints is not None or not incremental):
+        # validated when it was first loaded
+        return schema, 'resident'
+    with _phase('read cache'):
+        schema = _load_cache(filename) if filename else None
+    if schema is not None and incremental and schema.fingerprints is None:
+        schema = None
+    if schema is not None:
+        schema.path = path
+        schema.unresolved = validate_xml(schema)
+        if RESIDENT is not None:
+            RESIDENT[filename] = schema
+        return schema, 'cache'
+    schema = Schema(path, ntypes, roots, kind, incremental)
+    loader = 'incremental'
+    if previous is None or not _load_incremental(schema, previous):
+        loader = 'stream'
+        # the dependencies of roots are only known once the whole document is read
+        if roots is not None or not streaming or workers > 1 or not _load_streaming(schema):
+            loader = 'tree'
+            schema = Schema(path, ntypes, roots, kind, incremental)
+            _load_tree(schema, workers, min_parallel)
+    with _phase('resolve types'):
+        schema.resolve_types()
+        schema.analyze_types()
+    schema.unresolved = validate_xml(schema)
+    if filename:
+        with _phase('write cache'):
+            _save_cache(filename, schema)
+        if RESIDENT is not None:
+            RESIDENT[filename] = schema
+    return schema, loader
+
+def parse_kfm(ntypes=None, path=None, streaming=True, cache=True):
+    """
+    Import kfm.xml into a schema of its own, leaving the module globals a view of nif.xml.
+    See parse_xml for the parameters.
+    @rtype: Schema
+    """
+    return parse_xml(ntypes, path, streaming, cache, activate=False, kind=KFM)
+
+def validate_xml(schema=None, profile=None, strict=False):
+    """
+    Perform some basic validation on the data retrieved from the XML, by default on the global tables,
+    and check that its references resolve, see check_references().
+    @param profile: Add the time of the validation to this profile, else to the profile of parse_xml() in progress.
+    @type profile: Profile
+    @param strict: Raise a ValueError listing every reference which does not resolve, if any.
+    @type strict: bool
+    @return: A description of each reference which does not resolve.
+    @rtype: List[str]
+    """
+    with profile.phase('validate') if profile is not None else _phase('validate'):
+        _validate(schema)
+        problems = check_references(schema)
+    if problems and strict:
+        raise _unresolved_error(schema.path if schema is not None else "the XML", problems)
+    return problems
+
+def _unresolved_error(source, problems): # type: (str, List[str]) -> ValueError
+    """The error of a strict validation, listing the references which do not resolve."""
+    return ValueError("%d unresolved references in %s:\n  %s" % (len(problems), source, '\n  '.join(problems)))
+
+def check_references(schema=None): # type: (Optional[Schema]) -> List[str]
+    """
+    Returns a description of each reference which does not resolve, by default in the global tables:
+    of the storage type of an enum, the parent of a niobject, and of the type, template, and names read
+    by the expressions of each field.  Names resolve to the fields of the compound or niobject and its ancestors,
+    to niobjects, to ARG, or to the version. Types reused by an incremental reparse are checked like the rest:
+
+    >>> import tempfile
+    >>> xml = '''<niftoolsxml><version num="20.0.0.5">Oblivion</version><basic name="uint">Int.</basic>
+    ...     <enum name="Kind" storage="bytex">Kind.<option value="0" name="NONE">None.</option></enum>
+    ...     <bitflags name="Mask" storage="uint">Mask.<option value="0" name="On">On.</option></bitflags>
+    ...     <compound name="Key"><add name="Value" type="uint">Value.</add></compound>
+    ...     <niobject name="NiObject" abstract="1">Object.</niobject>
+    ...     <niobject name="NiLost" inherit="NiMissing">Lost.</niobject>
+    ...     <niobject name="NiNode" inherit="NiObject"><add name="Flags" type="uint">%s</add></niobject>
+    ...     </niftoolsxml>'''
+    >>> with tempfile.NamedTemporaryFile('w', suffix='.xml', delete=False) as f:
+    ...     _ = f.write(xml % 'Flags.')
+    >>> old = parse_xml(path=f.name, cache=False, activate=False, incremental=True)
+    >>> with open(f.name, 'w') as f:
+    ...     _ = f.write(xml % 'Edited.')
+    >>> new = parse_xml(path=f.name, cache=False, activate=False, previous=old)
+    >>> os.remove(f.name)
+    >>> new.types_enum['Kind'] is old.types_enum['Kind']
+    True
+    >>> check_references(new)
+    ["enum Kind: unknown storage type 'bytex'", "niobject NiLost: unknown parent 'NiMissing'"]
+    """
+    (_, types_basic, types_enum, types_flag, types_compound, types_block, types_version,
+     _, _, _, _, _, _) = schema.tables() if schema else xml_tables()
+    problems = []
+    for tag, types in (('enum', types_enum), ('bitflags', types_flag)):
+        for enum in types.values():
+            if enum.storage_name not in types_basic:
+                problems.append("%s %s: unknown storage type '%s'" % (tag, enum.name, enum.storage_name))
+    for block in types_block.values():
+        # a parent declared after its child does not resolve either, see Block.resolve()
+        if block.inherit_name and block.inherit is None:
+            problems.append("niobject %s: unknown parent '%s'" % (block.name, block.inherit_name))
+    field_types = set(types_basic)
+    field_types.update(types_enum, types_flag, types_compound, ('TEMPLATE',))
+    other_names = set(types_block)
+    other_names.update(VERSION_TERMINALS)
+    other_names.add('ARG')
+    for tag, types in (('compound', types_compound), ('niobject', types_block)):
+        for compound in types.values():
+            scope = compound.inherited_member_index if tag == 'niobject' else compound.member_index
+            for mem in compound.members:
+                if mem.type not in field_types:
+                    problems.append("%s %s: field '%s' has unknown type '%s'" % (tag, compound.name, mem.name, mem.type))
+                if mem.template and mem.template not in field_types and mem.template not in types_block:
+                    problems.append("%s %s: field '%s' has unknown template '%s'"
+                                    % (tag, compound.name, mem.name, mem.template))
+                for attr, expr in zip(EXPRESSION_ATTRIBUTES, (mem.arr1, mem.arr2, mem.cond, mem.vercond)):
+                    if expr.lhs:
+                        for name in expr.get_names():
+                            if name not in scope and name not in other_names:
+                                problems.append("%s %s: %s of field '%s' reads unknown '%s'"
+                                                % (tag, compound.name, attr, mem.name, name))
+    return problems
+
+def _validate(schema):
+    """See validate_xml()"""
+    (_, types_basic, types_enum, types_flag, types_compound, types_block, types_version,
+     names_basic, names_compound, names_enum, names_flag, names_block, names_version) = \
+        schema.tables() if schema else xml_tables()
+    # a schema limited to some roots may need no compounds or blocks, and kfm.xml has no blocks or bitflags
+    partial = schema is not None and schema.roots is not None
+    kfm = schema is not None and schema.kind == KFM
+    assert types_version and names_version and len(types_version) == len(names_version)
+    assert types_basic and names_basic and len(types_basic) == len(names_basic)
+    assert (types_compound or partial) and len(types_compound) == len(names_compound)
+    assert (types_block or partial or kfm) and len(types_block) == len(names_block)
+    assert (types_enum or kfm) and len(types_enum) == len(names_enum)
+    assert (types_flag or kfm) and len(types_flag) == len(names_flag)
+
+    assert all(name for name in names_version)
+    assert all(name for name in names_basic)
+    assert all(name for name in names_compound)
+    assert all(name for name in names_block)
+    assert all(name for name in names_enum)
+    assert all(name for name in names_flag)